@@ -0,0 +1,73 @@
+# 压测用的 SSE MCP 服务，参数同 fake_stdio.py
+import argparse
+import asyncio
+import json
+import os
+import random
+
+import tornado.web
+
+optparser = argparse.ArgumentParser(description='fake SSE MCP server for benchmarks')
+optparser.add_argument('--port', type=int, default=9911)
+optparser.add_argument('--latency', type=float, default=0.0, help='每次调用的延迟（秒）')
+optparser.add_argument('--payload', type=int, default=64, help='返回文本的字节数')
+optparser.add_argument('--fail-rate', type=float, default=0.0, help='返回 JSON-RPC 错误的概率')
+optargs = optparser.parse_args()
+
+sessions = {}
+TOOLS = [{'name': 'echo', 'description': 'echo: echo the arguments back', 'inputSchema': {'type': 'object'}},
+         {'name': 'blob', 'description': 'blob: return a payload of the configured size', 'inputSchema': {'type': 'object'}}]
+
+
+class SSEHandler(tornado.web.RequestHandler):
+    async def get(self):
+        self.set_header('Content-Type', 'text/event-stream')
+        self.sid = os.urandom(8).hex()
+        self.closed = asyncio.Event()
+        sessions[self.sid] = self
+        self.write(f'event: endpoint\r\ndata: /messages?session_id={self.sid}\r\n\r\n')
+        await self.flush()
+        await self.closed.wait()
+
+    async def send(self, obj):
+        self.write('event: message\r\ndata: ' + json.dumps(obj) + '\r\n\r\n')
+        await self.flush()
+
+    def on_connection_close(self):
+        sessions.pop(self.sid, None)
+        self.closed.set()
+
+
+class MessageHandler(tornado.web.RequestHandler):
+    async def post(self):
+        session = sessions.get(self.get_argument('session_id'))
+        if not session:
+            self.set_status(404)
+            return self.finish()
+        req = json.loads(self.request.body)
+        self.set_status(202)
+        self.finish()
+        if 'id' not in req: return
+        if req['method'] == 'initialize':
+            result = {'protocolVersion': '2024-11-05', 'capabilities': {'tools': {}}, 'serverInfo': {'name': 'fake-sse', 'version': '0.1'}}
+        elif req['method'] == 'tools/list':
+            result = {'tools': TOOLS}
+        elif req['method'] == 'tools/call':
+            await asyncio.sleep(optargs.latency)
+            if random.random() < optargs.fail_rate:
+                return await session.send({'jsonrpc': '2.0', 'id': req['id'], 'error': {'code': -32001, 'message': 'injected failure'}})
+            params = req.get('params') or {}
+            text = json.dumps(params.get('arguments')) if params.get('name') == 'echo' else 'x' * optargs.payload
+            result = {'content': [{'type': 'text', 'text': text}]}
+        else:
+            result = {}
+        await session.send({'jsonrpc': '2.0', 'id': req['id'], 'result': result})
+
+
+async def main():
+    tornado.web.Application([('/sse', SSEHandler), ('/messages', MessageHandler)]).listen(optargs.port, address='127.0.0.1')
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
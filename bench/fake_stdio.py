@@ -0,0 +1,44 @@
+# 压测用的 stdio MCP 服务：每个 tools/call 在独立线程里按设定的延迟返回，可配置返回大小和失败率
+import argparse
+import json
+import random
+import sys
+import threading
+
+optparser = argparse.ArgumentParser(description='fake stdio MCP server for benchmarks')
+optparser.add_argument('--latency', type=float, default=0.0, help='每次调用的延迟（秒）')
+optparser.add_argument('--payload', type=int, default=64, help='返回文本的字节数')
+optparser.add_argument('--fail-rate', type=float, default=0.0, help='返回 JSON-RPC 错误的概率')
+optargs = optparser.parse_args()
+
+lock = threading.Lock()
+TOOLS = [{'name': 'echo', 'description': 'echo: echo the arguments back', 'inputSchema': {'type': 'object'}},
+         {'name': 'blob', 'description': 'blob: return a payload of the configured size', 'inputSchema': {'type': 'object'}}]
+
+
+def send(obj):
+    data = json.dumps(obj) + '\n'
+    with lock:
+        sys.stdout.write(data)
+        sys.stdout.flush()
+
+
+def reply(req):
+    if random.random() < optargs.fail_rate:
+        return send({'jsonrpc': '2.0', 'id': req['id'], 'error': {'code': -32001, 'message': 'injected failure'}})
+    params = req.get('params') or {}
+    text = json.dumps(params.get('arguments')) if params.get('name') == 'echo' else 'x' * optargs.payload
+    send({'jsonrpc': '2.0', 'id': req['id'], 'result': {'content': [{'type': 'text', 'text': text}]}})
+
+
+for line in sys.stdin:
+    req = json.loads(line)
+    if 'id' not in req: continue
+    if req['method'] == 'initialize':
+        send({'jsonrpc': '2.0', 'id': req['id'], 'result': {'protocolVersion': '2024-11-05', 'capabilities': {'tools': {}}, 'serverInfo': {'name': 'fake-stdio', 'version': '0.1'}}})
+    elif req['method'] == 'tools/list':
+        send({'jsonrpc': '2.0', 'id': req['id'], 'result': {'tools': TOOLS}})
+    elif req['method'] == 'tools/call':
+        threading.Timer(optargs.latency, reply, (req,)).start()
+    else:
+        send({'jsonrpc': '2.0', 'id': req['id'], 'result': {}})
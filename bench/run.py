@@ -0,0 +1,218 @@
+# mcpproxy.py 的压测脚本：用临时数据库起一个代理和假后端，通过 unix socket 打 SSE 会话，
+# 统计 tools/list、tools/call 和会话建立/断开的吞吐与 p50/p99/p999 延迟，结果写成 JSON 方便版本间对比
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from httpx_sse import EventSource
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.join(ROOT, 'bench')
+APP_ID = 1
+
+optparser = argparse.ArgumentParser(description='mcpproxy 压测')
+optparser.add_argument('-b', '--backend', choices=['stdio', 'sse'], default='stdio', help='假后端类型')
+optparser.add_argument('--latency', type=float, default=0.0, help='假后端每次调用的延迟（秒）')
+optparser.add_argument('--payload', type=int, default=64, help='blob 工具返回的字节数')
+optparser.add_argument('--fail-rate', type=float, default=0.0, help='假后端返回错误的概率')
+optparser.add_argument('--tool', choices=['echo', 'blob'], default='echo', help='tools/call 场景调用的工具')
+optparser.add_argument('--backend-config', default='{}', help='合并进子服务配置的 JSON，例如 {"maxInFlight": 64}')
+optparser.add_argument('-c', '--sessions', type=int, default=32, help='并发会话数')
+optparser.add_argument('-n', '--requests', type=int, default=200, help='每个会话在每个场景里发出的请求数')
+optparser.add_argument('--churn', type=int, default=20, help='churn 场景每个并发连接建立/断开会话的次数')
+optparser.add_argument('--scenarios', default='tools_list,tools_call,churn', help='逗号分隔的场景列表')
+optparser.add_argument('--proxy-args', default='', help='传给 mcpproxy.py 的额外参数')
+optparser.add_argument('-o', '--output', default='', help='结果 JSON 的路径，默认 bench/results/<时间>-<后端>.json')
+optparser.add_argument('--compare', default='', help='与之前保存的结果 JSON 对比')
+optargs = optparser.parse_args()
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return dict(count=len(latencies), errors=errors, seconds=round(elapsed, 3),
+                throughput=round(len(latencies) / elapsed, 1) if elapsed else 0,
+                mean_ms=round(sum(latencies) * 1000 / len(latencies), 3) if latencies else 0,
+                p50_ms=round(percentile(latencies, 0.5) * 1000, 3),
+                p99_ms=round(percentile(latencies, 0.99) * 1000, 3),
+                p999_ms=round(percentile(latencies, 0.999) * 1000, 3),
+                max_ms=round(latencies[-1] * 1000, 3) if latencies else 0)
+
+
+class Session:
+
+    def __init__(self, client):
+        self.client = client
+        self.rpcid = 0
+        self.responses = {}
+        self.endpoint = asyncio.get_running_loop().create_future()
+
+    async def open(self):
+        self.stream = self.client.stream('GET', f'/mcp/{APP_ID}/sse')
+        response = await self.stream.__aenter__()
+        self.reader = asyncio.ensure_future(self.read(response))
+        await self.endpoint
+
+    async def read(self, response):
+        async for event in EventSource(response).aiter_sse():
+            if event.event == 'endpoint':
+                self.endpoint.set_result(event.data)
+            elif event.event == 'message':
+                data = json.loads(event.data)
+                fut = self.responses.pop(data.get('id'), None)
+                if fut and not fut.done(): fut.set_result(data)
+
+    async def call(self, method, params):
+        self.rpcid += 1
+        fut = asyncio.get_running_loop().create_future()
+        self.responses[self.rpcid] = fut
+        begin = time.perf_counter()
+        r = await self.client.post(self.endpoint.result(), content=json.dumps({'jsonrpc': '2.0', 'id': self.rpcid, 'method': method, 'params': params}))
+        if r.status_code != 202:
+            self.responses.pop(self.rpcid, None)
+            return time.perf_counter() - begin, True
+        data = await asyncio.wait_for(fut, timeout=60)
+        result = data.get('result') or {}
+        return time.perf_counter() - begin, 'error' in result or 'error' in data
+
+    async def close(self):
+        self.reader.cancel()
+        await self.stream.__aexit__(None, None, None)
+
+
+async def run_scenario(client, name, tool_name):
+    latencies, errors = [], 0
+
+    async def worker(idx):
+        nonlocal errors
+        if name == 'churn':
+            for _ in range(optargs.churn):
+                begin = time.perf_counter()
+                session = Session(client)
+                await session.open()
+                _, failed = await session.call('initialize', {})
+                _, failed2 = await session.call('tools/list', {})
+                await session.close()
+                latencies.append(time.perf_counter() - begin)
+                errors += failed or failed2
+            return
+        session = Session(client)
+        await session.open()
+        for i in range(optargs.requests):
+            if name == 'tools_list':
+                elapsed, failed = await session.call('tools/list', {})
+            else:
+                elapsed, failed = await session.call('tools/call', {'name': tool_name, 'arguments': {'session': idx, 'seq': i}})
+            latencies.append(elapsed)
+            errors += failed
+        await session.close()
+
+    begin = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(optargs.sessions)])
+    return summarize(latencies, errors, time.perf_counter() - begin)
+
+
+def prepare(workdir):
+    if optargs.backend == 'stdio':
+        server = {'command': sys.executable,
+                  'args': [os.path.join(BENCH, 'fake_stdio.py'), '--latency', str(optargs.latency), '--payload', str(optargs.payload), '--fail-rate', str(optargs.fail_rate)],
+                  'env': {'PATH': os.environ.get('PATH', '')}}
+    else:
+        server = {'baseUrl': 'http://127.0.0.1:9911/sse'}
+    server.update(json.loads(optargs.backend_config))
+    db = sqlite3.connect(os.path.join(workdir, 'mcpez.db'))
+    db.execute('CREATE TABLE appdb (id INTEGER PRIMARY KEY, name VARCHAR, description VARCHAR, item_type VARCHAR, hashcode VARCHAR UNIQUE, '
+               'config VARCHAR, functions VARCHAR, create_at INTEGER, modify_at INTEGER)')
+    db.execute('INSERT INTO appdb (id, name, description, item_type, hashcode, config) VALUES (?, ?, ?, ?, ?, ?)',
+               (APP_ID, 'bench', 'benchmark app', 'app', 'bench', json.dumps({'mcpServers': {'bench': server}})))
+    db.commit()
+    db.close()
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = json.load(f)['results']
+    print(f"\ncompared with {baseline_file}")
+    for name, cur in results.items():
+        old = baseline.get(name)
+        if not old: continue
+        cells = []
+        for key in ('throughput', 'p50_ms', 'p99_ms', 'p999_ms'):
+            delta = (cur[key] - old[key]) * 100 / old[key] if old[key] else 0
+            cells.append(f"{key} {old[key]} -> {cur[key]} ({delta:+.1f}%)")
+        print(f"  {name:<12} " + ', '.join(cells))
+
+
+def stop(procs):
+    # 等进程真正退出再删临时目录，不留僵尸进程和残留的 socket
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+async def main():
+    # 数据库、socket 和日志都放在临时目录里，跑完连同目录一起删掉
+    with tempfile.TemporaryDirectory(prefix='mcpez-bench-') as workdir:
+        prepare(workdir)
+        procs = []
+        logfile = open(os.path.join(workdir, 'proxy.log'), 'w')
+        if optargs.backend == 'sse':
+            procs.append(subprocess.Popen([sys.executable, os.path.join(BENCH, 'fake_sse.py'), '--latency', str(optargs.latency),
+                                           '--payload', str(optargs.payload), '--fail-rate', str(optargs.fail_rate)], stdout=logfile, stderr=logfile))
+            await asyncio.sleep(1)
+        procs.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'bin', 'mcpproxy.py'), '-c', str(APP_ID), '-s', workdir] + optargs.proxy_args.split(),
+                                      cwd=workdir, stdout=logfile, stderr=logfile))
+        socket_file = os.path.join(workdir, f'{APP_ID}.sock')
+        transport = httpx.AsyncHTTPTransport(uds=socket_file, limits=httpx.Limits(max_connections=optargs.sessions * 2 + 8))
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url='http://mcpez', timeout=60) as client:
+                for _ in range(300):
+                    try:
+                        status = (await client.get(f'/mcp/{APP_ID}/server_status')).json()
+                        if status.get('tools'): break
+                    except (httpx.TransportError, ValueError):
+                        pass
+                    await asyncio.sleep(0.1)
+                else:
+                    # 临时目录跑完就删了，日志的最后几行直接带在异常里
+                    logfile.flush()
+                    with open(logfile.name) as f:
+                        raise RuntimeError('proxy did not come up:\n' + ''.join(f.readlines()[-20:]))
+                # 代理会把工具名换成别名，假后端的描述以原工具名开头
+                tool_name = {t['description'].split(':')[0]: t['name'] for t in status['tools']}[optargs.tool]
+                results = {}
+                for name in optargs.scenarios.split(','):
+                    results[name] = await run_scenario(client, name, tool_name)
+                    r = results[name]
+                    print(f"{name:<12} {r['count']:>7} reqs {r['errors']:>5} err {r['throughput']:>9} req/s  "
+                          f"p50 {r['p50_ms']}ms  p99 {r['p99_ms']}ms  p999 {r['p999_ms']}ms  max {r['max_ms']}ms")
+        finally:
+            stop(procs)
+            logfile.close()
+
+    rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    output = optargs.output or os.path.join(BENCH, 'results', f"{time.strftime('%Y%m%d-%H%M%S')}-{optargs.backend}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(dict(meta=dict(time=int(time.time()), git=rev, args=vars(optargs)), results=results), f, indent=2)
+    print(f"results written to {output}")
+    if optargs.compare: compare(results, optargs.compare)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+from collections import OrderedDict
+import json
+import time
+
+
+class ResultCache:
+    # tools/call 结果缓存，key 为 (子服务, 工具名, 规范化后的参数)，按总字节数做 LRU 淘汰
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(srvname, toolname, arguments):
+        return (srvname, toolname, json.dumps(arguments or {}, sort_keys=True, separators=(',', ':')))
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item and item[1] > time.monotonic():
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+        if item: self.pop(key)
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl):
+        size = len(json.dumps(value)) + len(key[2])
+        if size > self.max_bytes: return
+        self.pop(key)
+        self.items[key] = (value, time.monotonic() + ttl, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self.pop(next(iter(self.items)))
+            self.evictions += 1
+
+    def pop(self, key):
+        item = self.items.pop(key, None)
+        if item: self.bytes -= item[2]
+
+    def status(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    entries=len(self.items), bytes=self.bytes, max_bytes=self.max_bytes)
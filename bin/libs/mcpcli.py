@@ -1,40 +1,199 @@
 import asyncio
 import json
 import logging
+import re
+import time
+from collections import OrderedDict, deque
+
+
+class BackendBusy(Exception):
+    pass
+
+
+# 大响应只要是 jsonrpc、id 在前、result 在最后这种常见顺序，就只认出 id，result 部分原样转发，不做解析
+# jsonrpc 写在 result 后面的不走这条路，否则切出来的 result 会带上后面的字段
+RAW_RESULT = re.compile(rb'^\s*\{\s*(?:"jsonrpc"\s*:\s*"2\.0"\s*,\s*"id"\s*:\s*(-?\d+)|"id"\s*:\s*(-?\d+)\s*,\s*"jsonrpc"\s*:\s*"2\.0")\s*,\s*"result"\s*:\s*')
+# 超长帧只留了开头，在进入任何嵌套对象之前找顶层的 id
+FRAME_ID = re.compile(rb'^\s*\{[^{}\[\]]*?"id"\s*:\s*(-?\d+)')
 
 
 class MCPCli:
 
+    http_options = dict(max_connections=256, max_keepalive_connections=32, keepalive_expiry=30.0, http2=False)
+    http_client = None
+    # 整个代理进程内等待后端响应的请求总数上限，0 为不限制
+    max_pending = 0
+    pending_total = 0
+    HTTP_TYPES = ('http', 'streamable-http', 'streamableHttp')
+
     def __init__(self, config, **kwargs):
         self.rpcid = 0
         self.rpc_responses = {}
+        # 在途请求的通知转发回调，按后端请求 id 索引
+        self.relays = {}
+        # 只有 tools/call 的结果可以原样转发，tools/list 等代理自己要读的响应照常解析
+        self.raw_ids = set()
         self.config = config
         self.name = kwargs.get('name')
         self.timeout = kwargs.get('timeout', 60)
-        self.config['type'] = 'sse' if config.get('baseUrl') else 'stdio'
+        # 远程后端默认走 SSE；type 为 streamable-http / http 时走 Streamable HTTP，地址取 url 或 baseUrl
+        if config.get('type') in self.HTTP_TYPES and (config.get('url') or config.get('baseUrl')):
+            self.config['type'] = 'http'
+        else:
+            self.config['type'] = 'sse' if config.get('baseUrl') else 'stdio'
         self.write = None
         self.tools = None
         self.process = None
+        # Streamable HTTP 的会话和在途的 POST，握手完成前就可能被 close
+        self.session_id = None
+        self.http_tasks = set()
+        self.tools_listeners = []
+        self.closed = False
+        # stdio 子进程退出后自动重启，spares 为预先启动并完成握手的热备进程数
+        self.spare_count = config.get('spares', 0)
+        self.spares = []
+        self.warming = 0
+        self.restarts = 0
+        self.restart_backoff = 0
+        # 单帧上限和走原样转发的阈值（字节）
+        self.max_frame = config.get('maxFrameBytes', 64 * 1024 * 1024)
+        self.raw_threshold = config.get('rawThreshold', 64 * 1024)
+        # 每个后端同时在途的请求数和排队长度，排队按调用方（session）轮转，避免一个会话的突发请求占满后端
+        self.max_inflight = config.get('maxInFlight', 16 if self.config['type'] == 'stdio' else 0)
+        self.max_queue = config.get('maxQueue', 256)
+        self.active = 0
+        self.queued = 0
+        self.waiters = OrderedDict()
+        self.stats = dict(rejected=0, waited=0, wait_total=0.0, wait_max=0.0)
         logging.info('created Mcpcli instance')
 
 
-    async def request(self, method, params, with_response=True, with_timeout=None):
-        assert self.write, "Connection not established"
+    async def request(self, method, params, with_response=True, with_timeout=None, owner=None, relay=None):
+        if not self.write:
+            raise ConnectionError(f"Backend {self.name} is not connected")
         
         if with_response:
-            self.rpcid += 1
-            json_rpc_data = {'method': method, 'params': params, 'jsonrpc': '2.0', 'id': self.rpcid}
-            fut = asyncio.Future()
-            self.rpc_responses[self.rpcid] = fut
+            # 排队和等后端响应共用一个时限，排队花掉的时间从等响应的时间里扣
+            timeout = with_timeout or self.timeout
+            deadline = time.monotonic() + timeout
+            try:
+                await asyncio.wait_for(self.acquire_slot(owner), timeout=timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Timeout waiting in queue for {method}({params})")
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: raise TimeoutError(f"Timeout waiting in queue for {method}({params})")
+                return await self.rpc(self.write, method, params, with_timeout=remaining, relay=relay)
+            finally:
+                self.release_slot()
+        else:
+            await self.notify(self.write, method, params)
+
+
+    async def rpc(self, write, method, params, with_timeout=None, relay=None):
+        if MCPCli.max_pending and MCPCli.pending_total >= MCPCli.max_pending:
+            raise BackendBusy(f"Proxy is busy: {MCPCli.pending_total} requests pending")
+        self.rpcid += 1
+        rpcid = self.rpcid
+        if relay:
+            # 不同调用方的 progressToken 可能重复，发给后端时换成这次请求的 id，进度通知回来时按 id 找到调用方
+            self.relays[rpcid] = relay
+            meta = params.get('_meta')
+            if meta and 'progressToken' in meta:
+                params = dict(params, _meta=dict(meta, progressToken=rpcid))
+        json_rpc_data = {'method': method, 'params': params, 'jsonrpc': '2.0', 'id': rpcid}
+        fut = asyncio.Future()
+        self.rpc_responses[rpcid] = fut
+        if method == 'tools/call': self.raw_ids.add(rpcid)
+        # stdio 子进程的 writer 记着经它发出、还在等响应的请求，进程退出时只让这些失败
+        pending = getattr(write, 'pending', None)
+        if pending is not None: pending.add(rpcid)
+        MCPCli.pending_total += 1
+        try:
             logging.debug(f"Sending request: {json_rpc_data}")
-            await self.write(json.dumps(json_rpc_data).encode() + b'\n')
+            await write(json.dumps(json_rpc_data).encode() + b'\n')
             try:
                 return await asyncio.wait_for(fut, timeout=with_timeout or self.timeout)
             except asyncio.TimeoutError:
+                self.cancel_remote(write, rpcid, 'timeout')
                 raise TimeoutError(f"Timeout waiting for response to {method}({params})")
-        else:
-            json_rpc_data = {'method': method, 'params': params, 'jsonrpc': '2.0'}
-            await self.write(json.dumps(json_rpc_data).encode() + b'\n')
+            except asyncio.CancelledError:
+                self.cancel_remote(write, rpcid, 'caller went away')
+                raise
+        finally:
+            # 无论完成、超时还是调用方取消，都把表项清掉，长时间运行内存不增长
+            self.rpc_responses.pop(rpcid, None)
+            self.relays.pop(rpcid, None)
+            self.raw_ids.discard(rpcid)
+            if pending is not None: pending.discard(rpcid)
+            MCPCli.pending_total -= 1
+
+
+    def cancel_remote(self, write, rpcid, reason):
+        if rpcid not in self.rpc_responses: return
+        async def send():
+            try:
+                await self.notify(write, 'notifications/cancelled', {'requestId': rpcid, 'reason': reason})
+            except Exception as e:
+                logging.debug(f"failed to cancel request {rpcid} on {self.name}: {e!r}")
+        asyncio.ensure_future(send())
+
+
+    async def notify(self, write, method, params):
+        json_rpc_data = {'method': method, 'params': params, 'jsonrpc': '2.0'}
+        await write(json.dumps(json_rpc_data).encode() + b'\n')
+
+
+    async def acquire_slot(self, owner):
+        if not self.max_inflight or (self.active < self.max_inflight and not self.queued):
+            self.active += 1
+            return
+        if self.queued >= self.max_queue:
+            self.stats['rejected'] += 1
+            raise BackendBusy(f"Backend {self.name} is busy: {self.active} in flight, {self.queued} queued")
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(owner, deque()).append(fut)
+        self.queued += 1
+        begin = time.monotonic()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release_slot()
+            else:
+                queue = self.waiters.get(owner)
+                if queue and fut in queue:
+                    queue.remove(fut)
+                    self.queued -= 1
+                    if not queue: del self.waiters[owner]
+            raise
+        finally:
+            waited = time.monotonic() - begin
+            self.stats['waited'] += 1
+            self.stats['wait_total'] += waited
+            self.stats['wait_max'] = max(self.stats['wait_max'], waited)
+
+
+    def release_slot(self):
+        # 空出来的位置直接交给下一个调用方的排队请求，active 不变
+        while self.waiters:
+            owner, queue = next(iter(self.waiters.items()))
+            fut = queue.popleft()
+            self.queued -= 1
+            if queue: self.waiters.move_to_end(owner)
+            else: del self.waiters[owner]
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+
+    def status(self):
+        return dict(inflight=self.active, queued=self.queued, pending=len(self.rpc_responses), max_inflight=self.max_inflight, max_queue=self.max_queue,
+                    rejected=self.stats['rejected'],
+                    wait_avg_ms=round(self.stats['wait_total'] * 1000 / self.stats['waited'], 2) if self.stats['waited'] else 0,
+                    wait_max_ms=round(self.stats['wait_max'] * 1000, 2),
+                    restarts=self.restarts, spares=len(self.spares))
 
 
     async def init(self):
@@ -42,93 +201,409 @@ class MCPCli:
             await self.start_stdio_mcp()
         elif self.config['type'] == 'sse':
             await self.start_sse()
+        elif self.config['type'] == 'http':
+            await self.start_http()
+
+
+    async def refresh_tools(self, with_timeout=10):
+        r = await self.request('tools/list', {}, with_timeout=with_timeout)
+        self.tools = r.get('result', {}).get('tools', [])
+        for listener in self.tools_listeners: listener(self)
+
+
+    def on_notification(self, data, related=None):
+        method = data.get('method')
+        if method == 'notifications/tools/list_changed':
+            asyncio.ensure_future(self.refresh_tools())
+        elif method in ('notifications/progress', 'notifications/message'):
+            # 进度按 progressToken（即后端请求 id）找到调用方；日志消息不带 token，只有在某个请求自己的响应流上收到时才知道该给谁
+            key = (data.get('params') or {}).get('progressToken') if method == 'notifications/progress' else related
+            relay = self.relays.get(key)
+            relay(data) if relay else logging.debug(f"Received notification: {data}")
+        else:
+            logging.debug(f"Received notification: {data}")
 
 
     def close(self):
+        self.closed = True
+        if self.config['type'] == 'http':
+            # 握手还没完成时 process 为空，在途的 POST 和已经建立的会话也要收掉
+            self.process and self.process.cancel()
+            for task in list(self.http_tasks): task.cancel()
+            self.fail_pending(ConnectionError(f"Backend {self.name} closed"))
+            self.session_id and asyncio.ensure_future(self.end_http_session(self.session_id))
+            return
+        if not self.process: return
         if self.config['type'] == 'stdio':
-            self.process.terminate()
+            for proc in [self.process] + self.spares:
+                proc.returncode is None and proc.terminate()
+            self.spares = []
         elif self.config['type'] == 'sse':
-            asyncio.ensure_future(self.process.aclose())
+            self.process.cancel()
+
+
+    async def handshake(self, write, with_timeout=10):
+        params = {'protocolVersion':'2024-11-05', 'capabilities': {}, 'clientInfo': {'name': 'EzMCPCli', 'version': '0.1.2'}}
+        if self.config['type'] == 'http':
+            # Streamable HTTP 的会话在 initialize 的响应里建立（Mcp-Session-Id），必须作为请求发送
+            await self.rpc(write, 'initialize', dict(params, protocolVersion='2025-03-26'), with_timeout=with_timeout)
+        else:
+            await self.notify(write, 'initialize', params)
+        await self.notify(write, 'notifications/initialized', {})
+        r = await self.rpc(write, 'tools/list', {}, with_timeout=with_timeout)
+        return r.get('result', {}).get('tools', [])
+
+
+    def dispatch_message(self, data, related=None):
+        if 'id' in data and 'method' not in data:
+            future = self.rpc_responses.pop(data['id'], None)
+            if future and not future.done(): future.set_result(data)
+            elif not future: logging.debug(f"Received unmatched response: {data}")
+        elif 'id' not in data:
+            self.on_notification(data, related)
+        else:
+            logging.debug(f"Ignored request from backend: {data}")
+
+
+    def on_frame(self, frame, related=None):
+        if len(frame) >= self.raw_threshold:
+            m = RAW_RESULT.match(frame)
+            end = len(frame.rstrip())
+            # 原样转发的结果会写进客户端的一行 SSE data，带换行的（格式化过的 JSON，HTTP/SSE 后端可能这样返回）要解析后重新序列化
+            # result 得是对象并且是最后一个字段：去掉外层的 } 之后剩下的也以 } 结尾
+            if m and frame[end - 1:end] == b'}' and frame[max(m.end(), end - 64):end - 1].rstrip().endswith(b'}') \
+                    and frame.find(b'\n', m.end(), end) < 0 and frame.find(b'\r', m.end(), end) < 0:
+                rpcid = int(m.group(1) or m.group(2))
+                if rpcid in self.raw_ids and rpcid in self.rpc_responses:
+                    return self.dispatch_message({'id': rpcid, 'raw_result': (frame, m.end(), end - 1)})
+        try:
+            self.dispatch_message(json.loads(frame), related)
+        except json.JSONDecodeError:
+            logging.warning(f"Failed to decode JSON: {repr(frame[:200])}")
+
+
+    def on_oversized_frame(self, head):
+        logging.warning(f"backend {self.name} sent a frame larger than {self.max_frame} bytes, dropped")
+        m = FRAME_ID.match(head)
+        future = self.rpc_responses.get(int(m.group(1))) if m else None
+        if future and not future.done():
+            future.set_exception(ValueError(f"Result from backend {self.name} exceeds maxFrameBytes ({self.max_frame} bytes)"))
+
+
+    def fail_pending(self, exc):
+        responses, self.rpc_responses = self.rpc_responses, {}
+        for future in responses.values():
+            if not future.done(): future.set_exception(exc)
+
+
+    @classmethod
+    def get_http_client(cls):
+        # 同一进程内所有 SSE 后端共用一个连接池
+        if cls.http_client is None or cls.http_client.is_closed:
+            import httpx
+            opts = cls.http_options
+            limits = httpx.Limits(max_connections=opts['max_connections'], max_keepalive_connections=opts['max_keepalive_connections'], keepalive_expiry=opts['keepalive_expiry'])
+            timeout = httpx.Timeout(None, connect=10.0)
+            try:
+                cls.http_client = httpx.AsyncClient(verify=False, timeout=timeout, limits=limits, http2=opts['http2'])
+            except ImportError:
+                logging.warning('http2 requires the h2 package, falling back to HTTP/1.1')
+                cls.http_client = httpx.AsyncClient(verify=False, timeout=timeout, limits=limits)
+        return cls.http_client
 
 
     async def start_sse(self):
-        import urllib.parse
-        from httpx_sse import EventSource
-        import httpx
-        client = httpx.AsyncClient(verify=False, timeout=httpx.Timeout(None, connect=10.0))
-        session_addr = None
+        self.session_addr = None
         is_connected = asyncio.Future()
+        self.write = self.sse_writer
+        self.process = asyncio.ensure_future(self.sse_loop(is_connected))
+        await is_connected
+        self.tools = await self.handshake(self.write, with_timeout=10)
 
-        async def start_loop():
+
+    async def sse_writer(self, data):
+        if not self.session_addr:
+            raise ConnectionError(f"Backend {self.name} is reconnecting")
+        r = await self.get_http_client().post(self.session_addr, content=data, headers=self.config.get('headers'), timeout=30)
+        r.raise_for_status()
+
+
+    async def sse_loop(self, is_connected):
+        import urllib.parse
+        from httpx_sse import EventSource
+        backoff = 1
+        while True:
             try:
-                async with client.stream('GET', self.config['baseUrl']) as response:
-                    self.process = client
-                    event_source = EventSource(response)
-                    async for event in event_source.aiter_sse():
-                        if client.is_closed: break
+                async with self.get_http_client().stream('GET', self.config['baseUrl'], headers=self.config.get('headers')) as response:
+                    response.raise_for_status()
+                    async for event in EventSource(response).aiter_sse():
                         if event.event == 'endpoint':
-                            session_addr = event.data if event.data.startswith('http') else urllib.parse.urljoin(self.config['baseUrl'], event.data)
-                            is_connected.set_result(session_addr)
+                            self.session_addr = event.data if event.data.startswith('http') else urllib.parse.urljoin(self.config['baseUrl'], event.data)
+                            backoff = 1
+                            if not is_connected.done():
+                                is_connected.set_result(self.session_addr)
+                            else:
+                                asyncio.ensure_future(self.reinitialize())
                         elif event.event == 'message':
-                            try:
-                                data = json.loads(event.data)
-                                if data.get('id') and data.get('result'):
-                                    future = self.rpc_responses.get(data['id'])
-                                    if future: future.set_result(data)
-                            except json.JSONDecodeError:
-                                logging.warning(f"Failed to decode JSON: {repr(event.data)}")
+                            self.on_frame(event.data.encode())
+                logging.warning(f"SSE stream of {self.name} closed by backend")
+            except asyncio.CancelledError:
+                self.fail_pending(ConnectionError(f"Backend {self.name} closed"))
+                raise
             except Exception as e:
-                await client.aclose()
+                logging.warning(f"SSE stream of {self.name} failed: {e!r}")
+                if not is_connected.done():
+                    is_connected.set_exception(e)
+                    return
+            # 断线后先让等待中的请求失败，然后退避重连，重连成功后重新握手并刷新工具列表
+            self.session_addr = None
+            self.fail_pending(ConnectionError(f"Backend {self.name} disconnected"))
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
 
-        def writer(data):
-            return client.post(session_addr, data=data)
 
-        
-        asyncio.ensure_future(start_loop())
-        session_addr = await is_connected
-        self.write = writer
-        await self.request('initialize', {'protocolVersion':'2024-11-05', 'capabilities': {}, 'clientInfo': {'name': 'EzMCPCli', 'version': '0.1.2'}}, with_response=False)
-        await self.request('notifications/initialized', {}, with_response=False)
-        r = await self.request('tools/list', {}, with_timeout=10)
-        self.tools = r.get('result', {}).get('tools', [])
+    async def reinitialize(self):
+        try:
+            self.tools = await self.handshake(self.write, with_timeout=10)
+            logging.info(f"backend {self.name} reconnected with {len(self.tools)} tools")
+            for listener in self.tools_listeners: listener(self)
+        except Exception as e:
+            logging.warning(f"backend {self.name} failed to reinitialize: {e!r}")
+
+
+    async def start_http(self):
+        self.endpoint = self.config.get('url') or self.config['baseUrl']
+        self.reinitializing = None
+        self.write = self.http_writer
+        self.tools = await self.handshake(self.write, with_timeout=10)
+        self.process = asyncio.ensure_future(self.http_listen())
+
+
+    def http_headers(self, accept):
+        headers = dict(self.config.get('headers') or {}, Accept=accept)
+        if self.session_id: headers['Mcp-Session-Id'] = self.session_id
+        return headers
+
+
+    async def http_writer(self, data):
+        # 每条消息一个 POST，响应（JSON 或 SSE 流）在后台读，读到的结果照常按 id 交给等待的请求
+        # 关闭后会话已经 DELETE 掉了，迟到的消息（如超时请求补发的 cancelled）不再发
+        if self.closed: return
+        task = asyncio.ensure_future(self.http_post(data))
+        self.http_tasks.add(task)
+        task.add_done_callback(self.http_tasks.discard)
+
+
+    async def http_post(self, data):
+        from httpx_sse import EventSource
+        try:
+            headers = dict(self.http_headers('application/json, text/event-stream'), **{'Content-Type': 'application/json'})
+            async with self.get_http_client().stream('POST', self.endpoint, content=data, headers=headers, timeout=self.timeout) as r:
+                if r.status_code == 404 and self.session_id:
+                    # 会话在服务端已经失效（比如服务重启），重新握手；已经关闭的后端和通知的 404 不为此新建会话，等着的请求直接失败
+                    if self.closed: raise ConnectionError(f"Backend {self.name} closed")
+                    if 'id' not in json.loads(data): return
+                    self.session_id = None
+                    self.reinitialize_http()
+                    raise ConnectionError(f"Backend {self.name} session expired")
+                r.raise_for_status()
+                self.session_id = r.headers.get('mcp-session-id') or self.session_id
+                ctype = r.headers.get('content-type', '')
+                if ctype.startswith('text/event-stream'):
+                    # 请求自己的响应流上收到的通知都属于这个请求
+                    related = json.loads(data).get('id')
+                    async for event in EventSource(r).aiter_sse():
+                        if event.event in ('message', '') and event.data: self.on_frame(event.data.encode(), related)
+                elif ctype.startswith('application/json'):
+                    body = await r.aread()
+                    frames = json.loads(body) if body.lstrip().startswith(b'[') else [body]
+                    for frame in frames:
+                        self.on_frame(frame) if isinstance(frame, bytes) else self.dispatch_message(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            msg = json.loads(data)
+            future = self.rpc_responses.get(msg.get('id'))
+            if future and not future.done(): future.set_exception(e)
+            elif not future: logging.warning(f"{msg.get('method')} to {self.name} failed: {e!r}")
+
+
+    def reinitialize_http(self):
+        if self.closed: return
+        if self.reinitializing and not self.reinitializing.done(): return
+        self.reinitializing = asyncio.ensure_future(self.reinitialize())
+
+
+    async def end_http_session(self, session_id):
+        try:
+            headers = dict(self.config.get('headers') or {}, **{'Mcp-Session-Id': session_id})
+            await self.get_http_client().delete(self.endpoint, headers=headers, timeout=5)
+        except Exception as e:
+            logging.debug(f"failed to end session of {self.name}: {e!r}")
+
+
+    async def http_listen(self):
+        # 可选的 GET 流，用来接收服务端主动发的通知（如 tools/list_changed）；服务端返回 405 表示不提供
+        from httpx_sse import EventSource
+        backoff = 1
+        while not self.closed:
+            try:
+                async with self.get_http_client().stream('GET', self.endpoint, headers=self.http_headers('text/event-stream')) as r:
+                    if r.status_code in (404, 405): return
+                    r.raise_for_status()
+                    backoff = 1
+                    async for event in EventSource(r).aiter_sse():
+                        if event.data: self.on_frame(event.data.encode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.debug(f"notification stream of {self.name} failed: {e!r}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
 
 
-    
     async def start_stdio_mcp(self):
+        self.activate(await self.spawn_stdio())
+        self.tools = self.process.tools
+        self.fill_spares()
+
+
+    async def spawn_stdio(self):
         proc = await asyncio.create_subprocess_exec(
             self.config['command'],
             *self.config['args'],
             env=self.config.get('env', None),
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+            stderr=asyncio.subprocess.PIPE,
+            limit=self.max_frame
         )
-        self.process = proc
+        proc.started = time.monotonic()
 
         async def writer(data):
+            if proc.returncode is not None or proc.stdin.is_closing():
+                raise ConnectionError(f"Backend {self.name} process {proc.pid} has exited")
             proc.stdin.write(data)
+            await proc.stdin.drain()
+
+        writer.pending = set()
+        proc.writer = writer
+        proc.stderr_tail = deque(maxlen=5)
 
-        self.write = writer
+        async def skip_line():
+            while True:
+                try:
+                    return await proc.stdout.readuntil(b'\n')
+                except asyncio.LimitOverrunError as e:
+                    await proc.stdout.read(e.consumed)
+                except asyncio.IncompleteReadError:
+                    return
 
         async def start_loop():
             while True:
-                line = await proc.stdout.readline()
+                try:
+                    line = await proc.stdout.readuntil(b'\n')
+                except asyncio.IncompleteReadError as e:
+                    line = e.partial
+                except asyncio.LimitOverrunError as e:
+                    # 超过 maxFrameBytes 的帧：留下开头认出 id，其余丢到换行为止，等这个结果的请求立即失败
+                    head = await proc.stdout.read(min(e.consumed, 4096))
+                    await skip_line()
+                    self.on_oversized_frame(head)
+                    continue
                 if not line:
                     break
-                try:
-                    data = json.loads(line.decode())
-                    if 'id' in data and data['id'] in self.rpc_responses:
-                        self.rpc_responses[data['id']].set_result(data)
-                        del self.rpc_responses[data['id']]
-                    else:
-                        logging.debug(f"Received notification: {data}")
-                except json.JSONDecodeError as e:
-                    logging.warning(f"Failed to decode JSON: {repr(line)}")
+                self.on_frame(line)
+            await proc.wait()
+            # 等 stderr 读完，退出原因多半在最后几行里；孙进程占着管道时不一直等
+            await asyncio.wait([stderr_task], timeout=1)
+            self.on_process_exit(proc)
+
+        async def drain_stderr():
+            # stderr 不读走的话管道写满会把子进程卡住
+            async for line in proc.stderr:
+                line = line.decode(errors='replace').rstrip()
+                line and proc.stderr_tail.append(line)
+                logging.debug(f"[{self.name}:{proc.pid}] {line}")
 
+        stderr_task = asyncio.ensure_future(drain_stderr())
         asyncio.ensure_future(start_loop())
+        try:
+            proc.tools = await self.handshake(writer, with_timeout=30)
+        except BaseException:
+            proc.returncode is None and proc.terminate()
+            raise
+        return proc
+
+
+    def activate(self, proc):
+        self.process = proc
+        self.write = proc.writer
+
+
+    def on_process_exit(self, proc):
+        # 这个进程上还在等响应的请求（包括握手中的 initialize、tools/list）立即失败，不再等超时
+        error = f"Backend {self.name} process {proc.pid} exited with {proc.returncode}"
+        if proc.stderr_tail: error += ': ' + ' | '.join(proc.stderr_tail)
+        proc.stdin.close()
+        for rpcid in list(proc.writer.pending):
+            future = self.rpc_responses.get(rpcid)
+            if future and not future.done(): future.set_exception(ConnectionError(error))
+        if proc in self.spares:
+            self.spares.remove(proc)
+            logging.warning(f"spare of backend {self.name} exited with {proc.returncode}")
+            self.closed or self.fill_spares()
+            return
+        if proc is not self.process or self.closed: return
+        logging.warning(f"backend {self.name} process {proc.pid} exited with {proc.returncode}, restarting")
+        # 之后由 supervise 重新拉起（优先使用热备进程）
+        self.write = None
+        asyncio.ensure_future(self.supervise(crashed_early=time.monotonic() - proc.started < 10))
+
+
+    async def supervise(self, crashed_early=False):
+        self.restart_backoff = min(max(self.restart_backoff * 2, 1), 60) if crashed_early else 0
+        while not self.closed:
+            # 有就绪的热备进程直接顶上，只有冷启动才需要退避
+            while self.spares and self.spares[0].returncode is not None: self.spares.pop(0)
+            try:
+                if self.spares:
+                    proc = self.spares.pop(0)
+                else:
+                    await asyncio.sleep(self.restart_backoff)
+                    if self.closed: return
+                    # 退避期间可能有热备进程就绪了
+                    while self.spares and self.spares[0].returncode is not None: self.spares.pop(0)
+                    proc = self.spares.pop(0) if self.spares else await self.spawn_stdio()
+            except Exception as e:
+                logging.warning(f"backend {self.name} failed to restart: {e!r}")
+                self.restart_backoff = min(max(self.restart_backoff * 2, 1), 60)
+                continue
+            if self.closed:
+                proc.terminate()
+                return
+            self.activate(proc)
+            self.restarts += 1
+            logging.info(f"backend {self.name} restarted as process {proc.pid}")
+            if proc.tools != self.tools:
+                self.tools = proc.tools
+                for listener in self.tools_listeners: listener(self)
+            self.fill_spares()
+            return
+
+
+    def fill_spares(self):
+        while len(self.spares) + self.warming < self.spare_count:
+            self.warming += 1
+            asyncio.ensure_future(self.warm_spare())
 
-        await self.request('initialize', {'protocolVersion':'2024-11-05', 'capabilities': {}, 'clientInfo': {'name': 'EzMCPCli', 'version': '0.1.2'}}, with_response=False)
-        await self.request('notifications/initialized', {}, with_response=False)
-        r = await self.request('tools/list', {}, with_timeout=30)
-        self.tools = r.get('result', {}).get('tools', [])
 
+    async def warm_spare(self):
+        try:
+            proc = await self.spawn_stdio()
+            if self.closed: proc.terminate()
+            else: self.spares.append(proc)
+        except Exception as e:
+            logging.warning(f"backend {self.name} failed to start a spare: {e!r}")
+        finally:
+            self.warming -= 1
@@ -1,62 +1,307 @@
-from libs.mcpcli import MCPCli
+from libs.mcppool import BackendPool
+from libs.mcpcache import ResultCache
+from libs.mcpmetrics import Metrics
+from libs.mcpcli import MCPCli, BackendBusy
 from libs.mcphandler import make_mcp_handlers
-import copy
-import os
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import re
+import time
+
+# 原样转发的结果不解析，只在字节里找 "isError": true；嵌套在别处的也算上，宁可当成失败也不把错误结果缓存下来
+RAW_IS_ERROR = re.compile(rb'(?<!\\)"isError"\s*:\s*true')
 
 class MCPEazy:
 
-    def __init__(self, name, description=''):
+    # 子服务配置里只给代理自己用的字段，不参与连接和共享
+    PROXY_KEYS = ('cache', 'coalesce', 'lazy', 'idleTimeout')
+
+    def __init__(self, name, description='', cache_size=64 * 1024 * 1024, idle_timeout=0):
         self.servers = {}
+        self.backends = {}
+        self.configs = {}
+        self.dormant = {}
+        self.waking = {}
+        self.last_used = {}
+        self.idle_rules = {}
+        self.idle_timeout = idle_timeout
+        self.reaper = None
+        self.cache_rules = {}
+        self.coalesce_rules = {}
+        self.inflight = {}
+        self.coalesced = 0
+        self.cache = ResultCache(max_bytes=cache_size)
+        self.metrics = Metrics()
         self.name = name
         self.description = description
         self.functions = {}
+        self.tools = []
+        self.tools_body = '{"tools": []}'
+        self.catalog_listeners = []
         self.ctxStore = None
+        self.keeper = None
         self.pathroute = None
         self.apps = None
 
+    def set_rules(self, name, config):
+        self.configs[name] = config
+        self.cache_rules[name] = self.parse_cache_rules(name, config.get('cache'))
+        self.coalesce_rules[name] = config.get('coalesce', True)
+        self.idle_rules[name] = config.get('idleTimeout', self.idle_timeout)
+        self.last_used[name] = time.monotonic()
+        if self.idle_rules[name] and not self.reaper:
+            self.reaper = asyncio.ensure_future(self.reap_idle())
+
+    @staticmethod
+    def parse_cache_rules(name, rules):
+        # cache 是 {工具名: TTL秒}，"*" 为默认值；直接给一个数字等同于 {"*": 数字}，写错的项忽略掉，不影响后端启动
+        if isinstance(rules, (int, float)) and not isinstance(rules, bool): rules = {'*': rules}
+        if not isinstance(rules, dict):
+            rules and logging.warning(f"backend {name} has an invalid cache rule {rules!r}, caching disabled")
+            return {}
+        valid = {tool: ttl for tool, ttl in rules.items() if isinstance(ttl, (int, float)) and not isinstance(ttl, bool) and ttl >= 0}
+        if len(valid) != len(rules):
+            logging.warning(f"backend {name} has invalid cache TTLs for {sorted(set(rules) - set(valid))}, ignored")
+        return valid
+
+    def add_lazy_server(self, name, config, tools):
+        # 懒加载：先用缓存的工具清单对外提供 tools/list，第一次 tools/call 时才真正启动/连接后端
+        self.set_rules(name, config)
+        self.dormant[name] = tools
+        self.backends[name] = {'status': 'idle', 'started_at': None, 'elapsed': None}
+        self.build_catalog()
+
     async def add_mcp_server(self, name, config):
-        subsrv = MCPCli(config)
-        await subsrv.init()
+        begin = time.time()
+        self.backends[name] = {'status': 'starting', 'started_at': int(begin), 'elapsed': None}
+        try:
+            subsrv = await BackendPool.acquire({k: v for k, v in config.items() if k not in self.PROXY_KEYS}, name=name)
+        except BaseException as e:
+            # 启动时限到了的取消带 'timeout'，代理停止、app 卸载时的取消记为 cancelled
+            status = 'failed' if not isinstance(e, asyncio.CancelledError) else 'timeout' if e.args == ('timeout',) else 'cancelled'
+            self.backends[name].update(status=status, elapsed=round(time.time() - begin, 3), error=str(e))
+            raise
+        self.backends[name].update(status='ready', elapsed=round(time.time() - begin, 3), shared=subsrv.refcnt > 1,
+                                   discovered_at=int(time.time()))
+        subsrv.tools_listeners.append(self.on_tools_changed)
+        self.set_rules(name, config)
         self.servers[name] = subsrv
+        self.dormant.pop(name, None)
+        self.build_catalog()
         return self.servers[name]
 
-    async def add_to_server(self, app, pathroute=''):
+    async def wake(self, name):
+        if name in self.servers: return self.servers[name]
+        task = self.waking.get(name)
+        if not task:
+            # 同一个后端并发的首次调用只启动一次
+            task = self.waking[name] = asyncio.ensure_future(self.add_mcp_server(name, self.configs[name]))
+            task.add_done_callback(lambda _: self.waking.pop(name, None))
+        return await asyncio.shield(task)
+
+    def hibernate(self, name):
+        # 空闲的后端还给连接池，工具清单留在 dormant 里继续对外提供
+        srv = self.servers.pop(name)
+        srv.tools_listeners.remove(self.on_tools_changed)
+        self.dormant[name] = srv.tools or []
+        self.backends[name].update(status='idle', idle_since=int(time.time()))
+        BackendPool.release(srv)
+        self.build_catalog()
+
+    async def reap_idle(self):
+        while True:
+            timeouts = [t for t in self.idle_rules.values() if t]
+            await asyncio.sleep(min(max(min(timeouts or [60]) / 2, 1), 30))
+            now = time.monotonic()
+            for name, srv in list(self.servers.items()):
+                timeout = self.idle_rules.get(name)
+                if not timeout or now - self.last_used[name] < timeout: continue
+                status = srv.status()
+                if status['inflight'] or status['queued'] or status['pending']: continue
+                logging.info(f"backend {name} idle for {now - self.last_used[name]:.0f}s, shutting down")
+                self.hibernate(name)
+
+    async def add_to_server(self, app, pathroute='', **options):
         self.apps = app
         self.pathroute = pathroute
-        make_mcp_handlers(app, self, pathroute=pathroute, name=self.name)
+        make_mcp_handlers(app, self, pathroute=pathroute, name=self.name, **options)
 
     async def stop(self):
         names = list(self.servers.keys())
         for name in names:
             srv = self.servers.pop(name, None)
-            srv.close()
-        for route in self.apps.default_router.rules[0].target.rules:
-            if route.target_kwargs.get('name') == self.name:
-                self.apps.default_router.rules[0].target.rules.remove(route)
+            srv.tools_listeners.remove(self.on_tools_changed)
+            BackendPool.release(srv)
+        for task in list(self.waking.values()):
+            task.cancel()
+        if self.reaper: self.reaper.cancel()
+        self.reaper = None
+        self.dormant.clear()
+        self.build_catalog()
+        self.keeper and self.keeper.stop()
+        for ctxid, session in list((self.ctxStore or {}).items()):
+            self.ctxStore.pop(ctxid, None)
+            session.cancel_tasks()
+            session.finish()
+        if not self.apps: return
+        # add_handlers 给每个app插入一组独立的规则，按 ctxStore 找到自己那一组整组摘掉；留着的话重新挂载时旧路由排在前面会把新的挡住
+        for router in (self.apps.default_router, self.apps.wildcard_router):
+            router.rules[:] = [rule for rule in router.rules if not self.owns_rule(rule)]
 
-    def get_tools(self, openai=None):
+    def owns_rule(self, rule):
+        routes = getattr(rule.target, 'rules', None) or []
+        return any(getattr(route, 'target_kwargs', {}).get('ctxStore') is self.ctxStore for route in routes)
+
+    @staticmethod
+    def tool_alias(srvname, toolname):
+        # 同一个后端的同一个工具永远得到同一个名字，客户端缓存的列表不会因为别人刷新而失效
+        return hashlib.md5(f'{srvname}\x00{toolname}'.encode()).hexdigest()[:10]
+
+    def build_catalog(self):
+        tools, functions = [], {}
+        sources = [(srvname, srv, srv.tools) for srvname, srv in self.servers.items()]
+        sources += [(srvname, None, cached) for srvname, cached in self.dormant.items() if srvname not in self.servers]
+        for srvname, srv, srvtools in sources:
+            for tool in srvtools or []:
+                alias = self.tool_alias(srvname, tool['name'])
+                rules = self.cache_rules.get(srvname, {})
+                ttl = rules.get(tool['name'], rules.get('*', 0))
+                functions[alias] = {'name': tool['name'], 'srv': srv, 'srvname': srvname, 'ttl': ttl,
+                                    'coalesce': self.coalesce_rules.get(srvname, True)}
+                tools.append(dict(tool, name=alias))
+        self.functions = functions
+        self.tools = tools
+        self.tools_body = json.dumps({'tools': tools})
+        for listener in self.catalog_listeners:
+            listener(self)
+
+    def on_tools_changed(self, srv):
+        for name, subsrv in self.servers.items():
+            if subsrv is srv: self.backends[name]['discovered_at'] = int(time.time())
+        self.build_catalog()
+
+    def manifest(self):
+        # 可以落库的工具清单：原始工具名、对外别名、描述、参数 schema 以及来源后端
         tools = []
-        self.functions = {}
-        for srv in self.servers.values():
-            for tool in srv.tools:
-                namehash = os.urandom(5).hex()
-                self.functions[namehash] = {'name':tool['name'], 'srv':srv}
-                _tool = copy.deepcopy(tool)
-                _tool['name'] = namehash
-                tools.append(_tool)
-        return tools
+        for tool in self.tools:
+            func = self.functions[tool['name']]
+            tools.append({'name': func['name'], 'alias': tool['name'], 'description': tool.get('description', ''),
+                          'inputSchema': tool.get('inputSchema', {}), 'server': func['srvname']})
+        servers = {name: {'discovered_at': self.backends.get(name, {}).get('discovered_at')}
+                   for name in itertools.chain(self.servers, self.dormant)}
+        return {'tools': tools, 'servers': servers, 'discovered_at': int(time.time())}
+
+    def get_tools(self, openai=None):
+        return self.tools
 
     async def list_tools(self, req, session):
-        await session.write_jsonrpc(req['id'], {'tools':self.get_tools()})
+        await session.write_jsonrpc_raw(req['id'], self.tools_body)
+
+    async def request_backend(self, _srv, params, call_key, owner=None, relay=None):
+        # 相同的调用正在进行时不再重复发给后端，等同一个结果；带 _meta（如 progressToken）的调用不合并
+        if not _srv['coalesce'] or '_meta' in params:
+            return await _srv['srv'].request('tools/call', params, owner=owner, relay=relay)
+        flight = self.inflight.get(call_key)
+        if flight and not flight['fut'].done():
+            self.coalesced += 1
+            flight['waiters'] += 1
+        else:
+            fut = asyncio.ensure_future(_srv['srv'].request('tools/call', params, owner=owner))
+            flight = self.inflight[call_key] = {'fut': fut, 'waiters': 1}
+            fut.add_done_callback(lambda _, flight=flight: self.drop_flight(call_key, flight))
+        try:
+            return await asyncio.shield(flight['fut'])
+        except asyncio.CancelledError:
+            # 所有等待者都走了才真正取消后端调用；先摘掉表项，之后同样的调用另起一次，不会接上正在取消的
+            flight['waiters'] -= 1
+            if not flight['waiters']:
+                self.drop_flight(call_key, flight)
+                flight['fut'].cancel()
+            raise
+
+    def drop_flight(self, call_key, flight):
+        # 只摘自己那一项，取消后完成回调来得晚，这时表里可能已经是新的一次调用
+        if self.inflight.get(call_key) is flight: del self.inflight[call_key]
+
+    def pool_status(self):
+        # 本 app 的各个后端在进程内连接池里的引用计数，refcnt 大于 1 说明和别的 app 共用
+        entries = BackendPool.status()
+        return {name: dict(entries.get(srv.poolkey, {}), key=srv.poolkey) for name, srv in self.servers.items()}
+
+    def inflight_status(self):
+        return dict(pending=len(self.inflight), coalesced=self.coalesced,
+                    backend_pending=MCPCli.pending_total, max_pending=MCPCli.max_pending)
+
+    @staticmethod
+    def make_relay(req, session):
+        # 后端发来的进度/日志通知转给发起调用的会话，progressToken 换回调用方自己的
+        if not hasattr(session, 'write_notification'): return None
+        token = (req['params'].get('_meta') or {}).get('progressToken')
+        def relay(note):
+            params = note.get('params') or {}
+            if 'progressToken' in params: params = dict(params, progressToken=token)
+            asyncio.ensure_future(session.write_notification(note['method'], params))
+        return relay
+
+    @staticmethod
+    def iter_chunks(frame, start, end, size=256 * 1024):
+        for i in range(start, end, size):
+            yield frame[i:min(i + size, end)]
 
     async def call_tools(self, req, session):
         name = req['params'].get('name')
         if name not in self.functions:
             return await session.write_jsonrpc(req['id'], {'error': {'code': -32601, 'message': f"Method {name} not found"}})
         _srv = self.functions[name]
+        key = (_srv['srvname'], _srv['name'])
+        self.metrics.begin(key)
+        begin = self.last_used[_srv['srvname']] = time.monotonic()
+        ok = False
         try:
-            req['params']['name'] = _srv['name']
-            result = await _srv['srv'].request('tools/call', req['params'])
-            return await session.write_jsonrpc(req['id'], {'result': result.get('result')})
+            ok = await self.invoke_tool(_srv, req, session)
+        finally:
+            self.last_used[_srv['srvname']] = time.monotonic()
+            self.metrics.end(key, self.last_used[_srv['srvname']] - begin, ok)
+
+    async def invoke_tool(self, _srv, req, session):
+        call_key = ResultCache.make_key(_srv['srvname'], _srv['name'], req['params'].get('arguments'))
+        if _srv['ttl']:
+            cached = self.cache.get(call_key)
+            if cached is not None:
+                await session.write_jsonrpc(req['id'], {'result': cached})
+                return True
+        try:
+            if _srv['srv'] is None:
+                _srv = dict(_srv, srv=await self.wake(_srv['srvname']))
+            params = dict(req['params'], name=_srv['name'])
+            result = await self.request_backend(_srv, params, call_key, owner=getattr(session, 'ctxid', None),
+                                                relay=self.make_relay(req, session))
+            if 'raw_result' in result:
+                frame, start, end = result['raw_result']
+                if not _srv['ttl']:
+                    ok = not RAW_IS_ERROR.search(frame, start, end)
+                    await session.write_jsonrpc_chunks(req['id'], itertools.chain([b'{"result": '], self.iter_chunks(frame, start, end), [b'}']))
+                    return ok
+                result = {'result': json.loads(frame[start:end])}
+            if _srv['ttl'] and 'result' in result and not (isinstance(result['result'], dict) and result['result'].get('isError')):
+                self.cache.set(call_key, result['result'], _srv['ttl'])
+            if 'error' in result:
+                await session.write_jsonrpc(req['id'], {'error': result['error']})
+                return False
+            # result 不一定是对象，先算好成败再写响应，免得写完之后出错又补一个同 id 的错误
+            ok = not (isinstance(result.get('result'), dict) and result['result'].get('isError'))
+            await session.write_jsonrpc(req['id'], {'result': result.get('result')})
+            return ok
+        except BackendBusy as e:
+            await session.write_jsonrpc(req['id'], {'error': {'code': -32000, 'message': str(e)}})
         except Exception as e:
-            return await session.write_jsonrpc(req['id'], {'error': {'code': -32603, 'message': str(e)}})
\ No newline at end of file
+            await session.write_jsonrpc(req['id'], {'error': {'code': -32603, 'message': str(e)}})
+        return False
+
+    def render_metrics(self):
+        app = (self.pathroute or '').rsplit('/', 1)[-1] or self.name
+        return self.metrics.render(app, {name: srv.status() for name, srv in self.servers.items()}, self.cache.status(),
+                                   replica=getattr(self, 'replica', None))
@@ -1,4 +1,7 @@
 from tornado.web import RequestHandler
+from tornado.ioloop import PeriodicCallback
+from tornado.iostream import StreamClosedError
+import asyncio
 import json
 import os
 import logging
@@ -11,6 +14,8 @@ class SSEServer(RequestHandler):
         self._auto_finish = False
         self.ctxStore = kwargs.get('ctxStore')
         self.pathroute = kwargs.get('pathroute', '')
+        self.keeper = kwargs.get('keeper')
+        self.session_prefix = kwargs.get('session_prefix', '')
 
     def set_default_headers(self):
         self.set_header('Content-Type', 'text/event-stream')
@@ -23,21 +28,141 @@ class SSEServer(RequestHandler):
     def options(self): self.set_status(204)
 
     async def get(self):
-        self.ctxid = os.urandom(16).hex()
+        if self.keeper and not self.keeper.admit():
+            # 会话数到上限时直接拒绝，客户端稍后重试，不让连接和内存无限增长
+            self.set_status(503)
+            self.set_header('Content-Type', 'text/plain')
+            self.set_header('Retry-After', '5')
+            return self.finish('Too Many Sessions')
+        # 多副本部署时 session_id 带上副本号前缀，路由层据此把 /messages/ 发回建立会话的副本
+        self.ctxid = self.session_prefix + os.urandom(16).hex()
+        self.tasks = set()
+        self.last_active = self.last_write = time.monotonic()
+        self.streaming = False
+        # 分块写大结果时会让出事件循环，其它结果和通知要排队写，不能插进半个事件里
+        self.lock = asyncio.Lock()
         self.ctxStore[self.ctxid] = self
         await self.write_sse(self.pathroute+'/messages/?session_id=' + self.ctxid, 'endpoint')
 
     async def write_sse(self, data, event='message'):
-        self.write('event: ' + event + '\r\ndata: ' + data + '\r\n\r\n')
-        await self.flush()
+        async with self.lock:
+            self.write('event: ' + event + '\r\ndata: ' + data + '\r\n\r\n')
+            self.last_write = time.monotonic()
+            await self.flush()
+
+    def heartbeat(self):
+        # SSE 注释行，客户端会忽略；写失败说明连接已经半开，tornado 会走 on_connection_close 清理
+        try:
+            self.write(': ping\r\n\r\n')
+            self.last_write = time.monotonic()
+            self.flush().add_done_callback(lambda f: f.cancelled() or f.exception())
+        except Exception:
+            self.on_connection_close()
 
     async def write_jsonrpc(self, req_id, result):
         response = {'jsonrpc': '2.0', 'id': req_id, 'result': result}
         await self.write_sse( json.dumps(response) )
 
+    async def write_jsonrpc_chunks(self, req_id, chunks):
+        # 大结果分块写出并逐块 flush，不在内存里再拼一份完整的字符串；写的过程中不插心跳
+        async with self.lock:
+            self.streaming = True
+            try:
+                self.write('event: message\r\ndata: {"jsonrpc": "2.0", "id": ' + json.dumps(req_id) + ', "result": ')
+                for chunk in chunks:
+                    self.write(chunk)
+                    await self.flush()
+                self.write('}\r\n\r\n')
+                self.last_write = time.monotonic()
+                await self.flush()
+            finally:
+                self.streaming = False
+
+    async def write_jsonrpc_raw(self, req_id, result_body):
+        await self.write_sse('{"jsonrpc": "2.0", "id": ' + json.dumps(req_id) + ', "result": ' + result_body + '}')
+
+    async def write_error(self, req_id, code, message):
+        await self.write_sse(json.dumps({'jsonrpc': '2.0', 'id': req_id, 'error': {'code': code, 'message': message}}))
+
+    async def write_notification(self, method, params):
+        # 后端转发来的进度/日志通知；会话已经断开就丢掉
+        try:
+            await self.write_sse(json.dumps({'jsonrpc': '2.0', 'method': method, 'params': params}))
+        except StreamClosedError:
+            pass
+
+    def dispatch(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.on_task_done)
+        return task
+
+    def on_task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logging.warning(f"session {self.ctxid} task failed: {task.exception()!r}")
+
+    def cancel_tasks(self):
+        for task in list(self.tasks): task.cancel()
+
     def on_connection_close(self):
         if not hasattr(self, 'ctxid'): return
         self.ctxStore.pop(self.ctxid, None)
+        # 客户端断开后它的后端调用没人读了，取消掉并通知后端
+        self.cancel_tasks()
+
+    def evict(self):
+        self.on_connection_close()
+        try:
+            self.finish()
+        except Exception:
+            pass
+
+
+class SessionKeeper:
+    # 每个 app 一个：定时给安静的 SSE 流发心跳，清理长时间没有请求的会话，并限制会话总数
+
+    # Streamable HTTP 会话没有常驻连接，只记最后活跃时间，没配置空闲超时的话按这个时间回收
+    STREAM_IDLE = 3600
+
+    def __init__(self, ctxStore, heartbeat=15, idle_timeout=0, max_sessions=0):
+        self.ctxStore = ctxStore
+        self.streams = {}
+        self.heartbeat = heartbeat
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.rejected = 0
+        self.evicted = 0
+        intervals = [t for t in (heartbeat, idle_timeout or self.STREAM_IDLE) if t]
+        self.timer = PeriodicCallback(self.sweep, max(min(intervals) / 2, 1) * 1000)
+        self.timer.start()
+
+    def admit(self):
+        if self.max_sessions and len(self.ctxStore) + len(self.streams) >= self.max_sessions:
+            self.rejected += 1
+            return False
+        return True
+
+    def sweep(self):
+        now = time.monotonic()
+        for session in list(self.ctxStore.values()):
+            if self.idle_timeout and not session.tasks and now - session.last_active > self.idle_timeout:
+                self.evicted += 1
+                session.evict()
+            elif self.heartbeat and not session.streaming and now - session.last_write >= self.heartbeat:
+                session.heartbeat()
+        stream_idle = self.idle_timeout or self.STREAM_IDLE
+        for sid, last_active in list(self.streams.items()):
+            if now - last_active > stream_idle:
+                self.evicted += 1
+                self.streams.pop(sid, None)
+
+    def stop(self):
+        self.timer and self.timer.stop()
+
+    def status(self):
+        return dict(active=len(self.ctxStore), streams=len(self.streams), max_sessions=self.max_sessions, rejected=self.rejected, evicted=self.evicted,
+                    heartbeat=self.heartbeat, idle_timeout=self.idle_timeout)
 
 
 
@@ -47,6 +172,7 @@ class RPCServer(RequestHandler):
     def initialize(self, *args, **kwargs):
         self.executor = kwargs.get('executor')
         self.ctxStore = kwargs.get('ctxStore')
+        self.max_tasks = kwargs.get('max_tasks')
 
     def set_default_headers(self):
         self.set_header('Content-Type', 'text/event-stream')
@@ -61,19 +187,46 @@ class RPCServer(RequestHandler):
     async def post(self):
         ctxid = self.get_argument('session_id')
         session = self.ctxStore.get(ctxid)
-        req = json.loads(self.request.body)
-        req_method = req.get('method')
-        func = self.for_name(req_method)
-        if func: await func(req, session)
+        if session is None:
+            self.set_status(404)
+            return self.finish('Could not find session')
+        try:
+            body = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return self.finish('Parse error')
+        session.last_active = time.monotonic()
+        # JSON-RPC batch: 每个元素并发执行，各自的结果完成后立即写回 session
+        reqs = body if isinstance(body, list) else [body]
+        calls = []
+        for req in reqs or [None]:
+            if isinstance(req, dict) and 'method' not in req and ('result' in req or 'error' in req):
+                continue
+            if not isinstance(req, dict) or not isinstance(req.get('method'), str):
+                # 不是合法的请求（包括空 batch）也要回错误，客户端不会一直等
+                calls.append((session.write_error, (req.get('id') if isinstance(req, dict) else None, -32600, 'Invalid Request')))
+                continue
+            func = self.for_name(req['method'])
+            if func: calls.append((func, (req, session)))
+            elif 'id' in req: calls.append((session.write_error, (req['id'], -32601, f"Method {req['method']} not found")))
+        # 先回 202，调用在后台执行，结果通过 session 的 SSE 流写回
+        if len(session.tasks) + len(calls) > self.max_tasks:
+            self.set_status(429)
+            return self.finish('Too Many Requests')
+        for func, args in calls:
+            session.dispatch(func(*args))
         self.set_status(202)
         self.finish('Accepted')
 
     def for_name(self, method):
         return getattr(self, 'with_' + method.replace('/', '_'), None)
 
+    def initialize_result(self, req):
+        return {"protocolVersion":"2024-11-05","capabilities":{"experimental":{},"prompts":{"listChanged":False},"resources":{"subscribe":False,"listChanged":False},"tools":{"listChanged":False}},"serverInfo":{"name":"mcpsrv","version":"1.3.0"}}
+
     async def with_initialize(self, req, session):
         req_id = req.get('id')
-        result = {"protocolVersion":"2024-11-05","capabilities":{"experimental":{},"prompts":{"listChanged":False},"resources":{"subscribe":False,"listChanged":False},"tools":{"listChanged":False}},"serverInfo":{"name":"mcpsrv","version":"1.3.0"}}
+        result = self.initialize_result(req)
         await session.write_jsonrpc(req_id, result)
 
     async def with_tools_list(self, req, session):
@@ -99,6 +252,179 @@ class RPCServer(RequestHandler):
 
 
 
+class StreamableReply:
+    # Streamable HTTP 一次 POST 的回复：先把结果攒着，全部很快完成就作为 JSON 一次返回；
+    # 升级成 SSE 之后攒着的先写出去，后面完成一个写一个
+
+    def __init__(self, handler, ctxid, batch=False, accepts_sse=False):
+        self.handler = handler
+        self.ctxid = ctxid
+        self.batch = batch
+        self.accepts_sse = accepts_sse
+        self.tasks = set()
+        self.frames = []
+        self.streaming = False
+        self.lock = asyncio.Lock()
+
+    def dispatch(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def cancel_tasks(self):
+        for task in list(self.tasks): task.cancel()
+
+    async def emit(self, *parts):
+        if not self.streaming:
+            self.frames.append(parts)
+            return
+        # 分块写的过程中会让出事件循环，多个结果要排队写，不能交错
+        async with self.lock:
+            self.handler.write('event: message\r\ndata: ')
+            for part in parts:
+                self.handler.write(part)
+                await self.handler.flush()
+            self.handler.write('\r\n\r\n')
+            await self.handler.flush()
+
+    async def write_jsonrpc(self, req_id, result):
+        await self.emit(json.dumps({'jsonrpc': '2.0', 'id': req_id, 'result': result}))
+
+    async def write_jsonrpc_raw(self, req_id, result_body):
+        await self.emit('{"jsonrpc": "2.0", "id": ' + json.dumps(req_id) + ', "result": ' + result_body + '}')
+
+    async def write_jsonrpc_chunks(self, req_id, chunks):
+        await self.emit('{"jsonrpc": "2.0", "id": ' + json.dumps(req_id) + ', "result": ', *chunks, '}')
+
+    async def write_error(self, req_id, code, message):
+        await self.emit(json.dumps({'jsonrpc': '2.0', 'id': req_id, 'error': {'code': code, 'message': message}}))
+
+    async def write_notification(self, method, params):
+        # JSON 响应里只能放结果，有通知要发时立刻升级成 SSE；客户端不接受 SSE 就只能丢掉
+        if not self.accepts_sse or self.handler.closed: return
+        try:
+            await self.upgrade()
+            await self.emit(json.dumps({'jsonrpc': '2.0', 'method': method, 'params': params}))
+        except StreamClosedError:
+            pass
+
+    async def upgrade(self):
+        if self.streaming: return
+        self.streaming = True
+        self.handler.set_header('Content-Type', 'text/event-stream')
+        self.handler.set_header('Cache-Control', 'no-cache')
+        frames, self.frames = self.frames, []
+        for parts in frames:
+            await self.emit(*parts)
+
+    def finish(self):
+        if self.streaming: return self.handler.finish()
+        self.handler.set_header('Content-Type', 'application/json')
+        if self.batch: self.handler.write('[')
+        for i, parts in enumerate(self.frames):
+            if i: self.handler.write(',')
+            for part in parts: self.handler.write(part)
+        if self.batch: self.handler.write(']')
+        self.handler.finish()
+
+
+class StreamableServer(RPCServer):
+    # MCP Streamable HTTP（/mcp）：一个请求一个来回，不需要常驻的 SSE 流。
+    # upgrade_after 秒内完成的调用直接在 POST 的响应里返回 JSON，更慢的升级成 SSE 流逐个返回
+
+    PROTOCOL_VERSIONS = ('2025-03-26', '2025-06-18')
+
+    def initialize(self, *args, **kwargs):
+        super().initialize(*args, **kwargs)
+        self._auto_finish = False
+        self.keeper = kwargs.get('keeper')
+        self.session_prefix = kwargs.get('session_prefix', '')
+        self.upgrade_after = kwargs.get('upgrade_after', 1.0)
+        self.reply = None
+        self.closed = False
+
+    def set_default_headers(self):
+        self.set_header('Access-Control-Allow-Origin', '*')
+        self.set_header('Access-Control-Allow-Headers', 'Content-Type, Accept, Mcp-Session-Id, Mcp-Protocol-Version')
+        self.set_header('Access-Control-Expose-Headers', 'Mcp-Session-Id')
+        self.set_header('Access-Control-Allow-Methods', 'POST, GET, DELETE, OPTIONS')
+
+    def options(self):
+        self.set_status(204)
+        self.finish()
+
+    def get(self):
+        # 没有服务端主动推送的消息，不提供独立的 GET 流
+        self.set_status(405)
+        self.set_header('Allow', 'POST, DELETE, OPTIONS')
+        self.finish()
+
+    def delete(self):
+        sid = self.request.headers.get('Mcp-Session-Id')
+        if not sid or self.keeper.streams.pop(sid, None) is None:
+            self.set_status(404)
+        self.finish()
+
+    def fail(self, status, message):
+        self.set_status(status)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps({'jsonrpc': '2.0', 'id': None, 'error': {'code': -32000, 'message': message}}))
+
+    async def post(self):
+        try:
+            body = json.loads(self.request.body)
+        except ValueError:
+            return self.fail(400, 'Parse error')
+        items = body if isinstance(body, list) else [body]
+        msgs = [m for m in items if isinstance(m, dict)]
+        sid = self.request.headers.get('Mcp-Session-Id')
+        if any(m.get('method') == 'initialize' for m in msgs):
+            if not self.keeper.admit():
+                self.set_header('Retry-After', '5')
+                return self.fail(503, 'Too Many Sessions')
+            sid = self.session_prefix + os.urandom(16).hex()
+            self.set_header('Mcp-Session-Id', sid)
+        elif not sid:
+            return self.fail(400, 'Missing Mcp-Session-Id header')
+        elif sid not in self.keeper.streams:
+            # 会话不存在（过期或代理重启过），按协议返回 404，客户端会重新 initialize
+            return self.fail(404, 'Session not found')
+        self.keeper.streams[sid] = time.monotonic()
+        reqs = [m for m in msgs if isinstance(m.get('method'), str) and 'id' in m]
+        # 不是合法请求的元素（包括空 batch）回 -32600，和 /messages/ 一致；通知和客户端发回的响应不用回
+        invalid = [m.get('id') if isinstance(m, dict) else None for m in items or [None]
+                   if not isinstance(m, dict) or not isinstance(m.get('method'), str) and 'result' not in m and 'error' not in m]
+        if not reqs and not invalid:
+            self.set_status(202)
+            return self.finish()
+        if len(reqs) + len(invalid) > self.max_tasks:
+            return self.fail(429, 'Too Many Requests')
+        accepts_sse = 'text/event-stream' in self.request.headers.get('Accept', '')
+        self.reply = StreamableReply(self, sid, batch=isinstance(body, list) and bool(body), accepts_sse=accepts_sse)
+        tasks = [self.reply.dispatch(self.reply.write_error(req_id, -32600, 'Invalid Request')) for req_id in invalid]
+        for req in reqs:
+            func = self.for_name(req['method'])
+            coro = func(req, self.reply) if func else self.reply.write_error(req['id'], -32601, f"Method {req['method']} not found")
+            tasks.append(self.reply.dispatch(coro))
+        _, pending = await asyncio.wait(tasks, timeout=self.upgrade_after)
+        if pending and accepts_sse:
+            await self.reply.upgrade()
+        if pending:
+            await asyncio.wait(pending)
+        if not self.closed:
+            self.reply.finish()
+
+    def on_connection_close(self):
+        # 客户端不等结果了，取消这次请求里还在跑的调用
+        self.closed = True
+        self.reply and self.reply.cancel_tasks()
+
+    def initialize_result(self, req):
+        version = (req.get('params') or {}).get('protocolVersion')
+        return dict(super().initialize_result(req), protocolVersion=version if version in self.PROTOCOL_VERSIONS else self.PROTOCOL_VERSIONS[0])
+
+
 class ServerStatus(RequestHandler):
     def initialize(self, *args, **kwargs):
         self.ctxStore = kwargs.get('ctxStore')
@@ -122,20 +448,44 @@ class ServerStatus(RequestHandler):
             name = self.name,
             description = self.executor.description,
             init_time = self.init_time,
+            pid = os.getpid(),
+            replica = getattr(self.executor, 'replica', None),
             status = 'ok',
             connection_cnt = len(self.ctxStore),
+            sessions = self.executor.keeper.status() if self.executor.keeper else None,
+            backends = self.executor.backends,
+            cache = self.executor.cache.status(),
+            inflight = self.executor.inflight_status(),
+            queues = {name: srv.status() for name, srv in self.executor.servers.items()},
+            pool = self.executor.pool_status(),
             tools = self.executor.get_tools()
             ))
 
 
 
 
-def make_mcp_handlers(application, executor, pathroute='',name=''):
+class MetricsHandler(RequestHandler):
+    def initialize(self, *args, **kwargs):
+        self.executor = kwargs.get('executor')
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.finish(self.executor.render_metrics())
+
+
+
+
+def make_mcp_handlers(application, executor, pathroute='',name='', max_tasks=32, max_sessions=0, heartbeat=15, session_idle=0, session_prefix='', upgrade_after=1.0):
     ctxStore = {}
+    keeper = SessionKeeper(ctxStore, heartbeat=heartbeat, idle_timeout=session_idle, max_sessions=max_sessions)
     executor.ctxStore = ctxStore
     executor.pathroute = pathroute
+    executor.keeper = keeper
     application.add_handlers('.*', [
-        (pathroute + '/sse', SSEServer, {'ctxStore': ctxStore, 'pathroute': pathroute, 'name':name}),
-        (pathroute + '/messages/', RPCServer, {'executor': executor, 'ctxStore': ctxStore, 'name':name}),
+        (pathroute + '/sse', SSEServer, {'ctxStore': ctxStore, 'pathroute': pathroute, 'name':name, 'keeper': keeper, 'session_prefix': session_prefix}),
+        (pathroute + '/mcp', StreamableServer, {'executor': executor, 'ctxStore': ctxStore, 'name': name, 'max_tasks': max_tasks,
+                                                'keeper': keeper, 'session_prefix': session_prefix, 'upgrade_after': upgrade_after}),
+        (pathroute + '/messages/', RPCServer, {'executor': executor, 'ctxStore': ctxStore, 'name':name, 'max_tasks': max_tasks}),
         (pathroute + '/server_status', ServerStatus, {'ctxStore': ctxStore,  'executor': executor, 'name': name, 'init_time': int(time.time())}),
+        (pathroute + '/metrics', MetricsHandler, {'ctxStore': ctxStore, 'executor': executor, 'name': name}),
     ])
\ No newline at end of file
@@ -0,0 +1,73 @@
+from collections import defaultdict
+import bisect
+
+
+class Metrics:
+    # 按 (子服务, 工具) 统计调用次数、错误数、在途数和延迟直方图，输出 Prometheus 文本格式
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.inflight = defaultdict(int)
+        self.latency_sum = defaultdict(float)
+        self.latency_buckets = defaultdict(lambda: [0] * (len(self.BUCKETS) + 1))
+
+    def begin(self, key):
+        self.inflight[key] += 1
+
+    def end(self, key, elapsed, ok):
+        self.inflight[key] -= 1
+        self.calls[key] += 1
+        if not ok: self.errors[key] += 1
+        self.latency_sum[key] += elapsed
+        self.latency_buckets[key][bisect.bisect_left(self.BUCKETS, elapsed)] += 1
+
+    @staticmethod
+    def labels(**kwargs):
+        return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in kwargs.items()) + '}'
+
+    def render(self, app, backends, cache, replica=None):
+        lines = []
+        # 多副本时每个样本带上副本号，控制面合并各副本的指标时不会重名
+        base = dict(app=app) if replica is None else dict(app=app, replica=replica)
+        def labels(**kwargs):
+            return self.labels(**base, **kwargs)
+        def family(name, kind, help):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        family('mcpez_tool_calls_total', 'counter', 'tools/call requests handled by the proxy')
+        for (srv, tool), v in self.calls.items():
+            lines.append(f'mcpez_tool_calls_total{labels(backend=srv, tool=tool)} {v}')
+        family('mcpez_tool_errors_total', 'counter', 'tools/call requests that ended in an error')
+        for (srv, tool), v in self.errors.items():
+            lines.append(f'mcpez_tool_errors_total{labels(backend=srv, tool=tool)} {v}')
+        family('mcpez_tool_inflight', 'gauge', 'tools/call requests currently being handled')
+        for (srv, tool), v in self.inflight.items():
+            lines.append(f'mcpez_tool_inflight{labels(backend=srv, tool=tool)} {v}')
+        family('mcpez_tool_latency_seconds', 'histogram', 'tools/call latency as seen by the proxy')
+        for (srv, tool), buckets in self.latency_buckets.items():
+            cumulative = 0
+            for le, n in zip(self.BUCKETS + ('+Inf',), buckets):
+                cumulative += n
+                lines.append(f'mcpez_tool_latency_seconds_bucket{labels(backend=srv, tool=tool, le=le)} {cumulative}')
+            lines.append(f'mcpez_tool_latency_seconds_sum{labels(backend=srv, tool=tool)} {self.latency_sum[(srv, tool)]}')
+            lines.append(f'mcpez_tool_latency_seconds_count{labels(backend=srv, tool=tool)} {cumulative}')
+
+        for field, kind, help in (('inflight', 'gauge', 'requests holding a concurrency slot on the backend'),
+                                  ('queued', 'gauge', 'requests waiting for a concurrency slot on the backend'),
+                                  ('pending', 'gauge', 'requests waiting for a backend response'),
+                                  ('rejected', 'counter', 'requests rejected because the backend queue was full'),
+                                  ('restarts', 'counter', 'times the backend process was restarted')):
+            name = f'mcpez_backend_{field}' + ('_total' if kind == 'counter' else '')
+            family(name, kind, help)
+            for srv, status in backends.items():
+                lines.append(f'{name}{labels(backend=srv)} {status[field]}')
+
+        for field, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('entries', 'gauge'), ('bytes', 'gauge')):
+            name = f'mcpez_cache_{field}' + ('_total' if kind == 'counter' else '')
+            family(name, kind, f'result cache {field}')
+            lines.append(f'{name}{labels()} {cache[field]}')
+        return '\n'.join(lines) + '\n'
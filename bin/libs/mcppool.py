@@ -0,0 +1,50 @@
+from libs.mcpcli import MCPCli
+import asyncio
+import hashlib
+import json
+import logging
+
+
+class MCPPool:
+    # 相同配置（command/args/env 或 baseUrl/headers）的子服务在同一进程内只启动一份，按引用计数共享
+    # MCPCli 自己分配 rpcid，所以多个 app 共用一个连接时 JSON-RPC id 天然不会冲突
+
+    def __init__(self):
+        self.entries = {}
+
+    @staticmethod
+    def hashcode(config):
+        return hashlib.md5(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+    async def acquire(self, config, name=None):
+        key = self.hashcode(config)
+        cli = self.entries.get(key)
+        if not cli or (cli.ready.done() and (cli.ready.cancelled() or cli.ready.exception())):
+            cli = MCPCli(dict(config), name=name)
+            cli.poolkey = key
+            cli.refcnt = 0
+            cli.ready = asyncio.ensure_future(cli.init())
+            self.entries[key] = cli
+        else:
+            logging.info(f"reusing shared backend {key} for {name}")
+        cli.refcnt += 1
+        try:
+            await asyncio.shield(cli.ready)
+        except BaseException:
+            self.release(cli)
+            raise
+        return cli
+
+    def release(self, cli):
+        cli.refcnt -= 1
+        if cli.refcnt > 0: return
+        if self.entries.get(cli.poolkey) is cli:
+            self.entries.pop(cli.poolkey)
+        cli.ready.cancel()
+        cli.close()
+
+    def status(self):
+        return {key: dict(name=cli.name, refcnt=cli.refcnt, shared=cli.refcnt > 1) for key, cli in self.entries.items()}
+
+
+BackendPool = MCPPool()
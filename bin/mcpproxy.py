@@ -4,11 +4,14 @@ import tornado.web
 import argparse
 import sys, os
 import logging
+import signal
+import time
 
 from tornado.httpserver import HTTPServer
 from tornado.netutil import bind_unix_socket
 
 from libs.mcpez import MCPEazy
+from libs.mcpcli import MCPCli
 from sqlmodel import Field, SQLModel, Session, create_engine
 
 logging.basicConfig(level=logging.DEBUG)
@@ -16,8 +19,25 @@ logging.basicConfig(level=logging.DEBUG)
 
 optparser = argparse.ArgumentParser(description='MCP代理服务，支持从文件或数据库加载配置')
 optparser.add_argument('-c', '--id', type=int, default=0, help='app id')
+optparser.add_argument('--cache-size', type=int, default=64, help='tools/call 结果缓存的内存上限（MB），按子服务配置里的 cache 字段为工具设置TTL（秒），"*" 为默认值')
+optparser.add_argument('--session-tasks', type=int, default=32, help='每个SSE会话同时在后台执行的请求上限，超出时返回429')
+optparser.add_argument('--max-sessions', type=int, default=2048, help='每个app同时保持的SSE会话上限，超出时新连接直接返回503，0为不限制')
+optparser.add_argument('--heartbeat', type=float, default=15, help='SSE会话心跳间隔（秒），及时发现半开连接，0为不发送')
+optparser.add_argument('--session-idle', type=float, default=0, help='SSE会话多少秒没有任何请求就断开，0为不断开')
+optparser.add_argument('--upgrade-after', type=float, default=1.0, help='Streamable HTTP（/mcp）请求超过多少秒未完成就把响应升级为SSE流')
+optparser.add_argument('--http-max-connections', type=int, default=256, help='SSE后端共用连接池的最大连接数（每个SSE后端常驻占用一个）')
+optparser.add_argument('--http-keepalive', type=int, default=32, help='SSE后端共用连接池保留的空闲连接数')
+optparser.add_argument('--http2', action='store_true', help='SSE后端连接启用HTTP/2（需要安装h2）')
+optparser.add_argument('--max-pending', type=int, default=4096, help='整个代理进程等待后端响应的请求总数上限，0为不限制')
+optparser.add_argument('--lazy', action='store_true', help='子服务默认懒加载：有缓存的工具清单时先不启动，第一次调用时才启动（子服务配置里的 lazy 字段优先）')
+optparser.add_argument('--idle-timeout', type=float, default=0, help='子服务空闲多少秒后关闭，下次调用时再启动，0为不关闭（子服务配置里的 idleTimeout 字段优先）')
+optparser.add_argument('-r', '--replica', type=int, default=None, help='多副本部署时本进程的副本号，监听 {id}.{replica}.sock（0号副本同时监听 {id}.sock），session_id 带副本号前缀')
+optparser.add_argument('-H', '--host', action='store_true', help='宿主模式：一个进程内承载多个app，可通过控制通道动态挂载/卸载')
+optparser.add_argument('-a', '--apps', type=int, nargs='*', default=[], help='宿主模式下启动时加载的app id列表')
+optparser.add_argument('--control', default='', help='宿主模式的控制通道uds路径，默认为 {socketdir}/host.sock')
 optparser.add_argument('-s', '--socketdir', default='/var/run/mcpez', help='服务器端口号，也可以是一个uds路径，')
 optparser.add_argument('-n', '--name', default='mcpproxy',help='代理服务名称')
+optparser.add_argument('-t', '--startup-timeout', type=float, default=60, help='所有子服务启动的总时限（秒），超时未就绪的子服务会被放弃')
 optargs = optparser.parse_args()
 
 class AppDB(SQLModel, table=True):
@@ -31,59 +51,256 @@ class AppDB(SQLModel, table=True):
     modify_at: int = None
 
 
+engine = None
+
+
+def get_engine():
+    global engine
+    if engine is None:
+        engine = create_engine('sqlite:///./mcpez.db', connect_args={'check_same_thread': False})
+    return engine
+
+
+def get_app_record(app_id):
+    with Session(get_engine()) as session:
+        app = session.get(AppDB, app_id)
+        session.expunge_all()
+        return app
+
+
+def save_app_functions(app_id, functions):
+    # 只回写 functions，不动 modify_at，配置本身并没有变
+    with Session(get_engine()) as session:
+        app = session.get(AppDB, app_id)
+        if not app: return False
+        app.functions = functions
+        session.add(app)
+        session.commit()
+        return True
+
+
 class MCPProxy(MCPEazy):
-    def __init__(self, name="MCPProxy"):
-        super().__init__(name)
+    def __init__(self, app_id, name="MCPProxy", replica=None):
+        super().__init__(name, cache_size=optargs.cache_size * 1024 * 1024, idle_timeout=optargs.idle_timeout)
+        self.app_id = app_id
+        self.server = None
+        self.replica = replica
+        self.socket_file = f"{optargs.socketdir}/{app_id}.sock"
+        # 副本监听自己的 {id}.{replica}.sock；0号副本还监听 {id}.sock，承接状态、指标等不需要会话亲和的请求
+        self.socket_files = [self.socket_file] if replica is None else [f"{optargs.socketdir}/{app_id}.{replica}.sock"]
+        if replica == 0: self.socket_files.append(self.socket_file)
+        self.manifest_task = None
+        self.manifest_dirty = False
+        self.cached_tools = {}
+        # 返回时还没就绪的子服务在后台继续启动，停止时要一起取消，否则会在已经停掉的代理上再挂一个后端
+        self.startup_tasks = set()
+        self.startup_deadline = None
     
     async def load_config_from_db(self, app_id):
-        engine = create_engine('sqlite:///./mcpez.db')
-        with Session(engine) as session:
-            try:
-                app = session.get(AppDB, app_id)
-                if not app: raise Exception('Config is not Found')
-                if app.item_type != 'app': raise Exception('item is not a app')
-                self.name = app.name
-                self.description = app.description
-                return json.loads(app.config)
-            except Exception as e:
-                logging.error(e)
-                sys.exit(1)
+        # 读库放到线程池里，宿主模式下挂载 app 不阻塞其它 app 的事件循环
+        app = await asyncio.get_running_loop().run_in_executor(None, get_app_record, app_id)
+        if not app: raise Exception('Config is not Found')
+        if app.item_type != 'app': raise Exception('item is not a app')
+        self.name = app.name
+        self.description = app.description
+        self.cached_tools = {}
+        try:
+            manifest = json.loads(app.functions or '{}')
+            for tool in manifest.get('tools', []):
+                self.cached_tools.setdefault(tool['server'], []).append(
+                    {'name': tool['name'], 'description': tool.get('description', ''), 'inputSchema': tool.get('inputSchema', {})})
+        except Exception as e:
+            logging.warning(f"app {app_id} has an unreadable tool manifest: {e}")
+        return json.loads(app.config)
     
-    async def load_config(self):
+    async def start_backend(self, name, server_config):
+        begin = time.time()
+        try:
+            await self.add_mcp_server(name, server_config)
+            logging.info(f"backend {name} ready in {time.time() - begin:.2f}s")
+        except asyncio.CancelledError as e:
+            if e.args == ('timeout',):
+                logging.error(f"backend {name} missed the startup deadline after {time.time() - begin:.2f}s")
+            else:
+                logging.info(f"backend {name} startup cancelled after {time.time() - begin:.2f}s")
+            raise
+        except Exception as e:
+            logging.error(f"backend {name} failed after {time.time() - begin:.2f}s: {e}")
+
+    async def load_config(self, config):
+        # 所有子服务并发启动，只要有一个就绪就返回，其余的在后台继续启动，超过总时限的会被取消
         try:
-            config = await self.load_config_from_db(optargs.id)
-            active_servers = []
+            pending = []
             for name, server_config in config.get('mcpServers', {}).items():
-                try:
-                    await self.add_mcp_server(name, server_config)
-                    active_servers.append(name)
-                except Exception as e:
-                    logging.error(e)
-            
-            if not active_servers: raise Exception('no active servers found')
-            return active_servers
+                # 懒加载的子服务需要有上次落库的工具清单，没有的话只能先启动一次把工具发现出来
+                if server_config.get('lazy', optargs.lazy) and self.cached_tools.get(name):
+                    self.add_lazy_server(name, server_config, self.cached_tools[name])
+                    logging.info(f"backend {name} deferred with {len(self.cached_tools[name])} cached tools")
+                    continue
+                task = asyncio.ensure_future(self.start_backend(name, server_config))
+                task.add_done_callback(self.startup_tasks.discard)
+                self.startup_tasks.add(task)
+                pending.append(task)
+            self.startup_deadline = asyncio.get_running_loop().call_later(optargs.startup_timeout, self.cancel_startup, 'timeout')
+            while pending and not self.servers:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if not pending: self.startup_deadline.cancel()
+
+            if not self.servers and not self.dormant: raise Exception('no active servers found')
+            return list(self.servers.keys()) + list(self.dormant.keys())
         except Exception as e:
             logging.error(f"配置加载失败: {str(e)}")
             return []
-    
+
+    def cancel_startup(self, reason=None):
+        self.startup_deadline and self.startup_deadline.cancel()
+        for task in list(self.startup_tasks): task.cancel(reason)
+
+    async def stop(self):
+        self.cancel_startup()
+        await super().stop()
+
+    def on_catalog_changed(self, proxy):
+        # 工具清单有变化就回写数据库，控制面不用拉起进程也能知道每个app有哪些工具；多副本时只由0号副本回写
+        if not self.servers or self.replica: return
+        self.manifest_dirty = True
+        if not self.manifest_task or self.manifest_task.done():
+            self.manifest_task = asyncio.ensure_future(self.save_manifest())
+
+    async def save_manifest(self):
+        while self.manifest_dirty:
+            # 稍等一下，把启动阶段多个后端接连就绪的变化合并成一次写入
+            await asyncio.sleep(1)
+            self.manifest_dirty = False
+            if not self.servers: break
+            try:
+                manifest = json.dumps(self.manifest(), ensure_ascii=False)
+                await asyncio.get_running_loop().run_in_executor(None, save_app_functions, self.app_id, manifest)
+                logging.info(f"app {self.app_id} tool manifest saved with {len(self.tools)} tools")
+            except Exception as e:
+                logging.error(f"app {self.app_id} failed to save tool manifest: {e}")
+
+    async def serve(self, app):
+        config = await self.load_config_from_db(self.app_id)
+        await self.load_config(config)
+        self.catalog_listeners.append(self.on_catalog_changed)
+        self.on_catalog_changed(self)
+        await self.add_to_server(app, pathroute=f"/mcp/{self.app_id}", max_tasks=optargs.session_tasks,
+                                 max_sessions=optargs.max_sessions, heartbeat=optargs.heartbeat, session_idle=optargs.session_idle,
+                                 session_prefix='' if self.replica is None else f"{self.replica}.", upgrade_after=optargs.upgrade_after)
+        self.server = HTTPServer(app)
+        for socket_file in self.socket_files:
+            self.server.add_socket(bind_unix_socket(socket_file))
+            os.system(f"chmod 777 {socket_file}")
+            logging.info(f"HTTP Server runing at unix:{socket_file}:/mcp/{self.app_id}/sse")
+        self.server.start()
+
+    async def shutdown(self):
+        self.server and self.server.stop()
+        if self.on_catalog_changed in self.catalog_listeners: self.catalog_listeners.remove(self.on_catalog_changed)
+        if self.manifest_task: self.manifest_task.cancel()
+        await self.stop()
+        for socket_file in self.socket_files:
+            if os.path.exists(socket_file): os.remove(socket_file)
+
     @staticmethod
     async def start():
-        proxy = MCPProxy(name=optargs.name)
-        await proxy.load_config()
+        proxy = MCPProxy(optargs.id, name=optargs.name, replica=optargs.replica)
         app = tornado.web.Application(debug=True)
-        await proxy.add_to_server(app, pathroute=f"/mcp/{optargs.id}")
-        server = HTTPServer(app)
-        socket_file = f"{optargs.socketdir}/{optargs.id}.sock"
-        server.add_socket(bind_unix_socket(socket_file))
-        os.system(f"chmod 777 {socket_file}")
-        logging.info(f"HTTP Server runing at unix:{socket_file}:/mcp/{optargs.id}/sse")
-        server.start()
+        try:
+            await proxy.serve(app)
+        except Exception as e:
+            logging.error(e)
+            sys.exit(1)
+        return proxy
+
+
+class MCPHost:
+    # 一个事件循环里承载多个app，每个app仍然有自己的 /mcp/{id} 路由和 {id}.sock
+    def __init__(self):
+        self.proxies = {}
+        self.app = tornado.web.Application()
+        self.control_file = optargs.control or f"{optargs.socketdir}/host.sock"
+
+    async def attach(self, app_id):
+        if app_id in self.proxies: return self.proxies[app_id]
+        proxy = MCPProxy(app_id, name=f"{optargs.name}-{app_id}")
+        self.proxies[app_id] = proxy
+        try:
+            await proxy.serve(self.app)
+        except Exception:
+            self.proxies.pop(app_id, None)
+            await proxy.stop()
+            raise
+        return proxy
+
+    async def detach(self, app_id):
+        proxy = self.proxies.pop(app_id, None)
+        if not proxy: return False
+        await proxy.shutdown()
+        return True
+
+    def status(self):
+        return {str(app_id): dict(name=proxy.name, backends=proxy.backends, connection_cnt=len(proxy.ctxStore or {}))
+                for app_id, proxy in self.proxies.items()}
+
+    async def start(self):
+        results = await asyncio.gather(*[self.attach(app_id) for app_id in optargs.apps], return_exceptions=True)
+        for app_id, r in zip(optargs.apps, results):
+            if isinstance(r, Exception): logging.error(f"app {app_id} failed to attach: {r}")
+        self.control = HTTPServer(tornado.web.Application([
+            (r'/apps', HostControl, {'host': self}),
+            (r'/apps/(\d+)', HostControl, {'host': self}),
+        ]))
+        self.control.add_socket(bind_unix_socket(self.control_file))
+        logging.info(f"Host control channel runing at unix:{self.control_file}")
+        self.control.start()
+
+    async def shutdown(self):
+        self.control.stop()
+        await asyncio.gather(*[self.detach(app_id) for app_id in list(self.proxies)])
+        if os.path.exists(self.control_file): os.remove(self.control_file)
+
+
+class HostControl(tornado.web.RequestHandler):
+    def initialize(self, host):
+        self.host = host
+
+    def get(self, app_id=None):
+        self.finish(self.host.status())
+
+    async def post(self, app_id):
+        try:
+            proxy = await self.host.attach(int(app_id))
+            self.finish(dict(status='success', id=app_id, backends=proxy.backends))
+        except Exception as e:
+            self.set_status(500)
+            self.finish(dict(status='error', id=app_id, message=str(e)))
+
+    async def delete(self, app_id):
+        if not await self.host.detach(int(app_id)):
+            self.set_status(404)
+            return self.finish(dict(status='error', id=app_id, message='app is not attached'))
+        self.finish(dict(status='success', id=app_id))
 
 
 async def main():
-    await MCPProxy.start()
-    await asyncio.Event().wait()
+    MCPCli.max_pending = optargs.max_pending
+    MCPCli.http_options.update(max_connections=optargs.http_max_connections, max_keepalive_connections=optargs.http_keepalive, http2=optargs.http2)
+    # 收到 SIGTERM 时正常收尾：结束 stdio 子进程、删除 socket 文件，不留孤儿进程
+    stopping = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(sig, stopping.set)
+    if optargs.host:
+        host = MCPHost()
+        await host.start()
+        await stopping.wait()
+        await host.shutdown()
+    else:
+        proxy = await MCPProxy.start()
+        await stopping.wait()
+        await proxy.shutdown()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+import asyncio
+import argparse
+import itertools
+import logging
+import os
+import re
+
+import httpx
+import tornado.web
+
+from tornado.httpserver import HTTPServer
+from tornado.iostream import StreamClosedError
+from tornado.netutil import bind_unix_socket
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+
+optparser = argparse.ArgumentParser(description='多副本app的参考路由（不依赖OpenResty）：按 session_id 前缀把消息发回建立会话的副本，新的 SSE 连接轮流分给各副本')
+optparser.add_argument('-s', '--socketdir', default='/var/run/mcpez', help='代理服务的uds目录，与 mcpproxy.py 的 -s 一致')
+optparser.add_argument('-p', '--port', type=int, default=8780, help='监听端口')
+optparser.add_argument('-u', '--uds', default='', help='改为监听这个uds路径')
+optparser.add_argument('--timeout', type=float, default=300, help='转发非 SSE 请求的超时（秒）')
+optargs = optparser.parse_args()
+
+# 不能原样转发的逐跳头
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'upgrade', 'proxy-connection', 'te', 'trailer'}
+SESSION_REPLICA = re.compile(r'^(\d+)\.')
+
+
+class Router:
+    # 和 mcpez_ngx.conf 里 rewrite_by_lua_block 的规则一致：
+    #   session_id（Streamable HTTP 为 Mcp-Session-Id 头）形如 {replica}.{hex} 的请求发给 {id}.{replica}.sock
+    #   /sse 和不带会话的 /mcp 在 {id}.replicas 列出的副本之间轮转
+    #   带 replica 参数的（控制面按副本抓状态、指标）发给指定副本
+    #   其它请求（状态、指标）以及单副本的 app 都发给 {id}.sock
+    def __init__(self, socketdir):
+        self.socketdir = socketdir
+        self.clients = {}
+        self.turns = itertools.count()
+
+    def replicas(self, app_id):
+        try:
+            with open(f"{self.socketdir}/{app_id}.replicas") as f:
+                return f.read().split()
+        except OSError:
+            return []
+
+    def pick(self, app_id, path, session_id, replica=None):
+        if not (replica or '').isdigit():
+            replica = None
+            match = SESSION_REPLICA.match(session_id or '')
+            if match:
+                replica = match.group(1)
+            elif path.endswith('/sse') or path.endswith('/mcp'):
+                replicas = self.replicas(app_id)
+                if replicas: replica = replicas[next(self.turns) % len(replicas)]
+        return f"{self.socketdir}/{app_id}.sock" if replica is None else f"{self.socketdir}/{app_id}.{replica}.sock"
+
+    def client(self, socket_file):
+        # 每个副本 socket 一个带连接池的客户端
+        if socket_file not in self.clients:
+            transport = httpx.AsyncHTTPTransport(uds=socket_file)
+            self.clients[socket_file] = httpx.AsyncClient(transport=transport, base_url='http://mcpproxy',
+                                                          timeout=httpx.Timeout(optargs.timeout, read=None))
+        return self.clients[socket_file]
+
+
+class RouteHandler(tornado.web.RequestHandler):
+    SUPPORTED_METHODS = ('GET', 'POST', 'DELETE', 'OPTIONS')
+
+    def initialize(self, router):
+        self.router = router
+        self._auto_finish = False
+
+    async def proxy(self, app_id):
+        self.task = asyncio.current_task()
+        session_id = self.get_query_argument('session_id', None) or self.request.headers.get('Mcp-Session-Id')
+        socket_file = self.router.pick(app_id, self.request.path, session_id, self.get_query_argument('replica', None))
+        headers = {k: v for k, v in self.request.headers.get_all() if k.lower() not in HOP_HEADERS and k.lower() != 'host'}
+        client = self.router.client(socket_file)
+        request = client.build_request(self.request.method, self.request.uri, headers=headers, content=self.request.body or None)
+        try:
+            upstream = await client.send(request, stream=True)
+        except (httpx.ConnectError, FileNotFoundError) as e:
+            self.set_status(502)
+            return self.finish(f'Bad Gateway: {e}')
+        try:
+            self.set_status(upstream.status_code)
+            seen = set()
+            for k, v in upstream.headers.multi_items():
+                if k.lower() in HOP_HEADERS: continue
+                # 第一次出现覆盖 tornado 的默认头，重复的头（如 Set-Cookie）追加
+                (self.add_header if k.lower() in seen else self.set_header)(k, v)
+                seen.add(k.lower())
+            # SSE 流逐块转发，不做缓冲
+            async for chunk in upstream.aiter_raw():
+                self.write(chunk)
+                await self.flush()
+            self.finish()
+        except (StreamClosedError, asyncio.CancelledError):
+            pass
+        finally:
+            await upstream.aclose()
+
+    get = post = delete = options = proxy
+
+    def on_connection_close(self):
+        # 客户端断开时取消正在进行的转发，上游的 SSE 连接随之关闭
+        task = getattr(self, 'task', None)
+        task and task.cancel()
+
+
+async def main():
+    router = Router(optargs.socketdir)
+    server = HTTPServer(tornado.web.Application([(r'/mcp/(\d+)/.*', RouteHandler, {'router': router})]))
+    if optargs.uds:
+        server.add_socket(bind_unix_socket(optargs.uds))
+        os.system(f"chmod 777 {optargs.uds}")
+        logging.info(f"Router runing at unix:{optargs.uds}")
+    else:
+        server.listen(optargs.port)
+        logging.info(f"Router runing at :{optargs.port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,368 @@
+import asyncio
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import time
+
+import httpx
+import tornado.web
+
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_unix_socket
+
+logging.basicConfig(level=logging.INFO)
+
+
+optparser = argparse.ArgumentParser(description='MCP代理进程的常驻管理服务，进程状态落盘，控制面可以无状态地多进程运行')
+optparser.add_argument('-s', '--socketdir', default='/var/run/mcpez', help='代理服务的uds目录，与 mcpproxy.py 的 -s 一致')
+optparser.add_argument('--control', default='', help='控制通道uds路径，默认为 {socketdir}/supervisor.sock')
+optparser.add_argument('--state', default='', help='进程状态文件，默认为 {socketdir}/supervisor.json')
+optparser.add_argument('--health-interval', type=float, default=10, help='健康检查间隔（秒）')
+optparser.add_argument('--stop-timeout', type=float, default=10, help='停止服务时等待进程退出的时限（秒），超时后强制结束')
+optparser.add_argument('--min-uptime', type=float, default=10, help='副本运行超过这么多秒后退出会被自动拉起，启动即退出的不重启')
+optparser.add_argument('--host', action='store_true', help='单副本的 app 都挂到一个共享的宿主进程（mcpproxy.py -H）上，相同配置的后端在 app 之间只起一份；宿主进程退出会影响挂在上面的所有 app')
+optparser.add_argument('--proxy-args', default='', help='启动 mcpproxy.py 时附加的参数，如 "--lazy --idle-timeout 600"')
+optargs = optparser.parse_args()
+
+MCPPROXY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcpproxy.py')
+
+
+def pid_alive(pid):
+    if not pid: return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Supervisor:
+    # 代理进程由这里统一拉起和回收，状态（pid、socket、启动时间、健康）写到磁盘上，重启后重新接管还活着的进程
+    # 一个 app 可以有多个副本（worker），每个副本一个进程、一个 {id}.{replica}.sock，存活的副本号写在 {id}.replicas 里供路由层使用
+    # --host 时单副本的 app 挂到共享的宿主进程上（worker 带 host 标记，pid 是宿主进程的），宿主进程只在上面还有 app 时存在
+    def __init__(self):
+        self.socketdir = optargs.socketdir
+        self.state_file = optargs.state or f"{self.socketdir}/supervisor.json"
+        self.host_file = f"{self.socketdir}/host.sock"
+        self.services = {}
+        self.procs = {}
+        self.host = None
+        self.host_lock = asyncio.Lock()
+
+    def socket_file(self, app_id, replica=None):
+        return f"{self.socketdir}/{app_id}.sock" if replica is None else f"{self.socketdir}/{app_id}.{replica}.sock"
+
+    def replicas_file(self, app_id):
+        return f"{self.socketdir}/{app_id}.replicas"
+
+    def save(self):
+        tmp = f"{self.state_file}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.services, f, indent=2)
+        os.replace(tmp, self.state_file)
+
+    def publish_replicas(self, app_id):
+        record = self.services.get(app_id)
+        replicas = [w['replica'] for w in record['workers'] if w['replica'] is not None] if record else []
+        if not replicas:
+            if os.path.exists(self.replicas_file(app_id)): os.remove(self.replicas_file(app_id))
+            return
+        tmp = f"{self.replicas_file(app_id)}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(' '.join(map(str, replicas)) + '\n')
+        os.replace(tmp, self.replicas_file(app_id))
+
+    async def probe(self, app_id, socket_file):
+        try:
+            transport = httpx.AsyncHTTPTransport(uds=socket_file)
+            async with httpx.AsyncClient(transport=transport, base_url='http://mcpproxy', timeout=3) as client:
+                r = await client.get(f'/mcp/{app_id}/server_status')
+                r.raise_for_status()
+                return r.json()
+        except Exception:
+            return None
+
+    async def host_call(self, method, path):
+        transport = httpx.AsyncHTTPTransport(uds=self.host_file)
+        async with httpx.AsyncClient(transport=transport, base_url='http://mcpproxy', timeout=None) as client:
+            return await client.request(method, path)
+
+    async def hosted_apps(self):
+        try:
+            return set((await self.host_call('GET', '/apps')).json())
+        except Exception:
+            return None
+
+    async def adopt(self):
+        # 先按状态文件接管，再扫一遍 socket 目录，找回状态文件里没有记录但仍在服务的代理
+        try:
+            with open(self.state_file) as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            records = {}
+        for app_id, record in records.items():
+            workers = [dict(w, health='unknown') for w in record.get('workers', []) if pid_alive(w.get('pid'))]
+            if not workers: continue
+            self.services[app_id] = dict(record, workers=workers, health='unknown')
+            logging.info(f"adopted app {app_id} ({len(workers)} workers) from state file")
+            for w in workers:
+                if w.get('host'): self.host = dict(pid=w['pid'], started_at=0, restarts=0)
+        hosted = await self.hosted_apps() or set()
+        found = {}
+        for entry in os.listdir(self.socketdir) if os.path.isdir(self.socketdir) else []:
+            name, ext = os.path.splitext(entry)
+            app_id, _, replica = name.partition('.')
+            if ext != '.sock' or not app_id.isdigit() or app_id in self.services: continue
+            if replica and not replica.isdigit(): continue
+            found.setdefault(app_id, {})[int(replica) if replica else None] = f"{self.socketdir}/{entry}"
+        for app_id, sockets in found.items():
+            # 多副本时 {id}.sock 是0号副本的第二个监听地址，不单独算一个 worker
+            if len(sockets) > 1: sockets.pop(None, None)
+            workers = []
+            for replica, socket_file in sorted(sockets.items(), key=lambda item: -1 if item[0] is None else item[0]):
+                status = await self.probe(app_id, socket_file)
+                if status and pid_alive(status.get('pid')):
+                    workers.append(dict(replica=replica, pid=status['pid'], socket=socket_file,
+                                        started_at=status.get('init_time'), health='ok', restarts=0))
+                    if app_id in hosted:
+                        workers[-1]['host'] = True
+                        self.host = dict(pid=status['pid'], started_at=0, restarts=0)
+                else:
+                    os.remove(socket_file)
+            if not workers: continue
+            self.services[app_id] = dict(id=app_id, replicas=len(workers), started_at=workers[0]['started_at'],
+                                         health='ok', checked_at=int(time.time()), workers=workers)
+            logging.info(f"adopted app {app_id} ({len(workers)} workers) from socket files")
+        for app_id in self.services: self.publish_replicas(app_id)
+        self.save()
+
+    async def spawn(self, app_id, worker):
+        args = ['-c', app_id, '-s', self.socketdir]
+        if worker['replica'] is not None: args += ['--replica', str(worker['replica'])]
+        proc = await asyncio.create_subprocess_exec(sys.executable, MCPPROXY, *args, *optargs.proxy_args.split(),
+                                                    start_new_session=True)
+        worker.update(pid=proc.pid, started_at=int(time.time()), health='starting')
+        self.procs[proc.pid] = proc
+        asyncio.ensure_future(self.reap(app_id, worker, proc))
+        logging.info(f"started app {app_id} replica {worker['replica']} (pid {proc.pid})")
+
+    async def spawn_host(self):
+        proc = await asyncio.create_subprocess_exec(sys.executable, MCPPROXY, '-H', '-s', self.socketdir, '--control', self.host_file,
+                                                    *optargs.proxy_args.split(), start_new_session=True)
+        self.procs[proc.pid] = proc
+        self.host = dict(pid=proc.pid, started_at=time.time(), restarts=self.host['restarts'] + 1 if self.host else 0)
+        asyncio.ensure_future(self.reap_host(proc))
+        logging.info(f"started host process (pid {proc.pid})")
+        # 等控制通道能连上再挂 app
+        deadline = time.monotonic() + 30
+        while await self.hosted_apps() is None:
+            if proc.returncode is not None or time.monotonic() > deadline:
+                raise Exception(f"host process (pid {proc.pid}) failed to start")
+            await asyncio.sleep(0.2)
+
+    async def attach(self, app_id, worker):
+        async with self.host_lock:
+            if not self.host or not pid_alive(self.host['pid']): await self.spawn_host()
+        r = await self.host_call('POST', f'/apps/{app_id}')
+        if r.status_code != 200: raise Exception(r.json().get('message', f'attach failed with {r.status_code}'))
+        worker.update(pid=self.host['pid'], started_at=int(time.time()), health='starting', host=True)
+        logging.info(f"attached app {app_id} to host process (pid {self.host['pid']})")
+
+    async def stop_host(self):
+        # 宿主进程上最后一个 app 摘掉后，宿主进程也退出
+        if not self.host or any(self.is_hosted(record) for record in self.services.values()): return
+        pid, self.host = self.host['pid'], None
+        await self.terminate([pid])
+
+    @staticmethod
+    def is_hosted(record):
+        return any(w.get('host') for w in record['workers'])
+
+    async def start(self, app_id, replicas=1):
+        record = self.services.get(app_id)
+        if record: return record
+        if optargs.host and replicas == 1:
+            worker = dict(replica=None, socket=self.socket_file(app_id), health='starting', restarts=0)
+            record = self.services[app_id] = dict(id=app_id, replicas=1, started_at=int(time.time()), health='starting',
+                                                  checked_at=None, workers=[worker])
+            try:
+                await self.attach(app_id, worker)
+            except Exception:
+                self.services.pop(app_id, None)
+                await self.stop_host()
+                raise
+            self.save()
+            return record
+        workers = [dict(replica=None if replicas == 1 else i, socket=self.socket_file(app_id, None if replicas == 1 else i),
+                        health='starting', restarts=0) for i in range(replicas)]
+        record = self.services[app_id] = dict(id=app_id, replicas=replicas, started_at=int(time.time()), health='starting',
+                                              checked_at=None, workers=workers)
+        for worker in workers:
+            await self.spawn(app_id, worker)
+        self.publish_replicas(app_id)
+        self.save()
+        return record
+
+    async def reap(self, app_id, worker, proc):
+        code = await proc.wait()
+        self.procs.pop(proc.pid, None)
+        logging.info(f"app {app_id} replica {worker['replica']} (pid {proc.pid}) exited with {code}")
+        await self.on_worker_exit(app_id, worker)
+
+    async def reap_host(self, proc):
+        code = await proc.wait()
+        self.procs.pop(proc.pid, None)
+        logging.info(f"host process (pid {proc.pid}) exited with {code}")
+        await self.on_host_exit(proc.pid)
+
+    async def on_host_exit(self, pid):
+        # 宿主进程跑过一段时间才退出的，重新拉起并把原来的 app 挂回去；否则摘掉上面所有的 app
+        if not self.host or self.host['pid'] != pid: return
+        hosted = [app_id for app_id, record in self.services.items() if self.is_hosted(record) and not record.get('stopping')]
+        if time.time() - self.host['started_at'] < optargs.min_uptime:
+            self.host = None
+            for app_id in hosted: self.forget(app_id)
+            return
+        for app_id in hosted:
+            record = self.services.get(app_id)
+            if not record: continue
+            worker = record['workers'][0]
+            try:
+                await self.attach(app_id, worker)
+                worker['restarts'] += 1
+            except Exception as e:
+                logging.warning(f"failed to reattach app {app_id}: {e}")
+                self.forget(app_id)
+        self.save()
+
+    async def on_worker_exit(self, app_id, worker):
+        # 跑过一段时间才退出的副本自动拉起；一启动就退出的（配置错误之类）直接摘掉，避免反复重启
+        record = self.services.get(app_id)
+        if not record or worker not in record['workers'] or record.get('stopping'): return
+        if os.path.exists(worker['socket']): os.remove(worker['socket'])
+        if time.time() - worker['started_at'] >= optargs.min_uptime:
+            worker['restarts'] += 1
+            await self.spawn(app_id, worker)
+        else:
+            record['workers'].remove(worker)
+            self.publish_replicas(app_id)
+            if not record['workers']: return self.forget(app_id)
+        self.save()
+
+    def forget(self, app_id):
+        record = self.services.pop(app_id, None)
+        if not record: return
+        for worker in record['workers']:
+            if os.path.exists(worker['socket']): os.remove(worker['socket'])
+        if os.path.exists(self.socket_file(app_id)): os.remove(self.socket_file(app_id))
+        self.publish_replicas(app_id)
+        self.save()
+
+    async def stop(self, app_id):
+        record = self.services.get(app_id)
+        if not record: return False
+        record['stopping'] = True
+        if self.is_hosted(record):
+            try:
+                await self.host_call('DELETE', f'/apps/{app_id}')
+            except Exception as e:
+                logging.warning(f"failed to detach app {app_id} from host process: {e}")
+            self.forget(app_id)
+            await self.stop_host()
+            return True
+        await self.terminate([w['pid'] for w in record['workers']])
+        self.forget(app_id)
+        return True
+
+    async def terminate(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + optargs.stop_timeout
+        # 子进程退出后由 reap 回收；接管来的进程不是子进程，只能靠 pid 判断是否退出
+        while any(map(pid_alive, pids)) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for pid in filter(pid_alive, pids):
+            logging.warning(f"process {pid} ignored SIGTERM, killing it")
+            os.kill(pid, signal.SIGKILL)
+
+    async def check_health(self):
+        while True:
+            await asyncio.sleep(optargs.health_interval)
+            for app_id, record in list(self.services.items()):
+                for worker in list(record['workers']):
+                    # 还在挂载中的 worker 没有 pid
+                    if not worker.get('pid'): continue
+                    if worker['pid'] not in self.procs and not pid_alive(worker['pid']) and worker.get('host'):
+                        await self.on_host_exit(worker['pid'])
+                        break
+                    if worker['pid'] not in self.procs and not pid_alive(worker['pid']):
+                        logging.info(f"adopted app {app_id} replica {worker['replica']} (pid {worker['pid']}) is gone")
+                        await self.on_worker_exit(app_id, worker)
+                        continue
+                    status = await self.probe(app_id, worker['socket'])
+                    # 刚拉起或正在挂载的 worker 第一次探测成功之前一直是 starting，不算不可达
+                    worker['health'] = 'ok' if status else 'starting' if worker['health'] == 'starting' else 'unreachable'
+                healthy = sum(w['health'] == 'ok' for w in record['workers'])
+                starting = sum(w['health'] == 'starting' for w in record['workers'])
+                record.update(health='ok' if healthy == len(record['workers']) else 'starting' if healthy + starting == len(record['workers'])
+                              else 'degraded' if healthy else 'unreachable', checked_at=int(time.time()))
+            self.save()
+
+    async def run(self):
+        os.makedirs(self.socketdir, exist_ok=True)
+        await self.adopt()
+        control_file = optargs.control or f"{self.socketdir}/supervisor.sock"
+        control = HTTPServer(tornado.web.Application([
+            (r'/services', SupervisorControl, {'supervisor': self}),
+            (r'/services/(\d+)', SupervisorControl, {'supervisor': self}),
+        ]))
+        control.add_socket(bind_unix_socket(control_file))
+        os.system(f"chmod 777 {control_file}")
+        logging.info(f"Supervisor control channel runing at unix:{control_file}")
+        control.start()
+        asyncio.ensure_future(self.check_health())
+
+
+class SupervisorControl(tornado.web.RequestHandler):
+    def initialize(self, supervisor):
+        self.supervisor = supervisor
+
+    def get(self, app_id=None):
+        if app_id is None:
+            return self.finish(dict(status='success', services=self.supervisor.services))
+        record = self.supervisor.services.get(app_id)
+        if not record:
+            self.set_status(404)
+            return self.finish(dict(status='error', id=app_id, message='service is not running'))
+        self.finish(dict(status='success', service=record))
+
+    async def post(self, app_id):
+        try:
+            record = await self.supervisor.start(app_id, replicas=max(int(self.get_argument('replicas', 1)), 1))
+            self.finish(dict(status='success', service=record))
+        except Exception as e:
+            self.set_status(500)
+            self.finish(dict(status='error', id=app_id, message=str(e)))
+
+    async def delete(self, app_id):
+        if not await self.supervisor.stop(app_id):
+            self.set_status(404)
+            return self.finish(dict(status='error', id=app_id, message='service is not running'))
+        self.finish(dict(status='success', id=app_id))
+
+
+async def main():
+    await Supervisor().run()
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
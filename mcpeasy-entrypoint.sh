@@ -9,9 +9,14 @@ if [ $? -ne 0 ]; then
     exit 1
 fi
 
-# 启动主应用
-echo "Starting application..."
 cd /data/app
-uv run uvicorn mcpez.main:app
+
+# 启动代理进程管理服务，重启后会重新接管仍在运行的代理；--host 把单副本的 app 挂到同一个宿主进程，相同配置的后端只起一份
+echo "Starting supervisor..."
+uv run bin/mcpsupervisor.py --host &
+
+# 启动主应用，控制面不持有进程状态，可以多 worker 运行
+echo "Starting application..."
+uv run uvicorn mcpez.main:app --workers ${MCPEZ_WORKERS:-1}
 
 sleep infinity
\ No newline at end of file
@@ -1,20 +1,45 @@
 import json
 import time
+import base64
 import asyncio
 import httpx
 import hashlib
+import os
 
 
-from fastapi import FastAPI, Request, Response, Depends, HTTPException, Query
+from fastapi import FastAPI, Request, Response, HTTPException, Query
 from typing import Optional
 from sqlmodel import Field, SQLModel, Session, create_engine, select, Column, VARCHAR
+from sqlalchemy import event, bindparam, text
+from sqlalchemy.exc import OperationalError
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware  # 添加CORS中间件
+from fastapi.responses import StreamingResponse
 
 
 # 数据库配置
 DATABASE_URL = "sqlite:///./mcpez.db"
-engine = create_engine(DATABASE_URL)
+DB_WORKERS = int(os.environ.get('MCPEZ_DB_WORKERS', 4))
+# 连接池复用连接（sqlite3 按连接缓存预编译语句），同步的数据库操作都放到专用线程池里执行，不阻塞事件循环
+engine = create_engine(DATABASE_URL, connect_args={'check_same_thread': False}, pool_size=DB_WORKERS, max_overflow=0)
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='mcpez-db')
+# 访问各个代理服务（状态、指标）走同一个带连接池的客户端
+SERVICE_BASE = os.environ.get('MCPEZ_SERVICE_BASE', 'http://127.0.0.1')
+STATUS_TTL = float(os.environ.get('MCPEZ_STATUS_TTL', 2))
+SUPERVISOR_SOCK = os.environ.get('MCPEZ_SUPERVISOR', '/var/run/mcpez/supervisor.sock')
+service_client = None
+
+
+@event.listens_for(engine, 'connect')
+def on_db_connect(dbapi_conn, record):
+    # WAL 模式下读写互不阻塞，多个 uvicorn worker 同时访问也不容易锁库
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.close()
+
 
 class appDB(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -28,21 +53,238 @@ class appDB(SQLModel, table=True):
     modify_at: Optional[int] = Field(default=None)
 
 
+# 常用查询只构造一次，编译结果由 SQLAlchemy 缓存
+ITEM_BY_HASHCODE = select(appDB).where((appDB.item_type == bindparam('item_type')) & (appDB.hashcode == bindparam('hashcode')))
+
+# 列表默认只返回摘要字段，config/functions 这种大字段按需再取
+BRIEF_COLUMNS = 'appdb.id, appdb.name, appdb.description, appdb.item_type, appdb.create_at, appdb.modify_at'
+FULL_COLUMNS = BRIEF_COLUMNS + ', appdb.hashcode, appdb.config, appdb.functions'
+
+# 全文索引：名称、描述、服务器名/命令/地址、已发现的工具名和描述，由触发器和 appdb 保持同步
+SERVERS_TEXT = """coalesce((SELECT group_concat(CASE WHEN j.path = '$.mcpServers' THEN j.key ELSE j.value END, ' ')
+    FROM json_tree(CASE WHEN json_valid({row}.config) THEN {row}.config ELSE '{{}}' END) j
+    WHERE j.path = '$.mcpServers' OR (j.type = 'text' AND (j.key IN ('command', 'baseUrl', 'url') OR j.path LIKE '%.args'))), '')"""
+TOOLS_TEXT = """coalesce((SELECT group_concat(j.value, ' ')
+    FROM json_tree(CASE WHEN json_valid({row}.functions) THEN {row}.functions ELSE '{{}}' END) j
+    WHERE j.type = 'text' AND j.key IN ('name', 'description') AND j.path LIKE '$.tools[%]' AND j.path NOT LIKE '$.tools[%].%'), '')"""
+FTS_VALUES = "{row}.id, {row}.name, coalesce({row}.description, ''), " + SERVERS_TEXT + ", " + TOOLS_TEXT + ", {row}.item_type"
+FTS_COLUMNS = 'rowid, name, description, servers, tools, item_type'
+FTS_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS appdb_fts_insert AFTER INSERT ON appdb BEGIN
+        INSERT INTO appdb_fts({FTS_COLUMNS}) VALUES ({FTS_VALUES.format(row='new')});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS appdb_fts_delete AFTER DELETE ON appdb BEGIN
+        DELETE FROM appdb_fts WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS appdb_fts_update AFTER UPDATE ON appdb BEGIN
+        DELETE FROM appdb_fts WHERE rowid = old.id;
+        INSERT INTO appdb_fts({FTS_COLUMNS}) VALUES ({FTS_VALUES.format(row='new')});
+    END""",
+]
+# bm25 权重依次对应 name, description, servers, tools，分数越小越相关
+SEARCH_FTS = """SELECT {columns} FROM (
+        SELECT rowid AS fid, bm25(appdb_fts, 10.0, 4.0, 2.0, 3.0) AS score FROM appdb_fts
+        WHERE appdb_fts MATCH :match AND item_type = :item_type
+    ) s JOIN appdb ON appdb.id = s.fid
+    WHERE s.score > :score OR (s.score = :score AND s.fid > :after)
+    ORDER BY s.score, s.fid LIMIT :limit"""
+# 不足一个 trigram 的短查询退回到 LIKE 扫描
+SEARCH_LIKE = """SELECT {columns}, 0.0 AS score FROM appdb
+    WHERE item_type = :item_type AND (name LIKE :like ESCAPE '\\' OR description LIKE :like ESCAPE '\\')
+        AND (0.0 > :score OR (0.0 = :score AND id > :after))
+    ORDER BY id LIMIT :limit"""
+# 跨 app 按工具检索，只看代理回写的工具清单（tools 列）
+SEARCH_APP_TOOLS = """SELECT appdb.id, appdb.name, appdb.description, appdb.functions, s.score FROM (
+        SELECT rowid AS fid, bm25(appdb_fts, 0.0, 0.0, 0.0, 1.0) AS score FROM appdb_fts
+        WHERE appdb_fts MATCH :match AND item_type = 'app'
+    ) s JOIN appdb ON appdb.id = s.fid
+    WHERE s.score > :score OR (s.score = :score AND s.fid > :after)
+    ORDER BY s.score, s.fid LIMIT :limit"""
+SEARCH_APP_TOOLS_LIKE = """SELECT id, name, description, functions, 0.0 AS score FROM appdb
+    WHERE item_type = 'app' AND functions LIKE :like ESCAPE '\\'
+        AND (0.0 > :score OR (0.0 = :score AND id > :after))
+    ORDER BY id LIMIT :limit"""
+LIST_ITEMS = """SELECT {columns} FROM appdb
+    WHERE item_type = :item_type AND id > :after ORDER BY id LIMIT :limit"""
+search_trigram = True
+
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        create_search_index(session)
 
 
-def get_session():
-    with Session(engine) as session:
-        yield session
+def create_search_index(session):
+    global search_trigram
+    conn = session.connection()
+    try:
+        conn.exec_driver_sql("CREATE VIRTUAL TABLE IF NOT EXISTS appdb_fts USING fts5("
+                             "name, description, servers, tools, item_type UNINDEXED, tokenize='trigram')")
+    except OperationalError:
+        # 老版本 SQLite 没有 trigram 分词器，退回 unicode61 + 前缀匹配
+        search_trigram = False
+        conn.exec_driver_sql("CREATE VIRTUAL TABLE IF NOT EXISTS appdb_fts USING fts5("
+                             "name, description, servers, tools, item_type UNINDEXED)")
+    else:
+        options = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'appdb_fts'").scalar()
+        search_trigram = 'trigram' in (options or '')
+    for trigger in FTS_TRIGGERS:
+        conn.exec_driver_sql(trigger)
+    # 索引建立之前就有的数据（或者索引和数据对不上时）整体重建一次
+    items = conn.exec_driver_sql('SELECT count(*) FROM appdb').scalar()
+    indexed = conn.exec_driver_sql('SELECT count(*) FROM appdb_fts').scalar()
+    if items != indexed:
+        conn.exec_driver_sql('DELETE FROM appdb_fts')
+        conn.exec_driver_sql(f"INSERT INTO appdb_fts({FTS_COLUMNS}) SELECT {FTS_VALUES.format(row='appdb')} FROM appdb")
+    session.commit()
+
+
+async def run_db(fn, *args):
+    def work():
+        with Session(engine) as session:
+            return fn(session, *args)
+    return await asyncio.get_running_loop().run_in_executor(db_executor, work)
+
+
+def encode_cursor(score, id):
+    return base64.urlsafe_b64encode(json.dumps([score, id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return -1e308, 0
+    try:
+        score, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), int(id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def fts_match(query):
+    # 每个词按短语加引号，避免用户输入里的 FTS 语法字符（- : * 等）被解释
+    words = query.split()
+    if not words or (search_trigram and any(len(word) < 3 for word in words)):
+        return None
+    suffix = '' if search_trigram else '*'
+    return ' '.join('"' + word.replace('"', '""') + '"' + suffix for word in words)
+
+
+def page_rows(rows, limit):
+    items = [dict(row._mapping) for row in rows]
+    cursor = None
+    if limit and len(items) == limit:
+        cursor = encode_cursor(items[-1].pop('score', 0.0), items[-1]['id'])
+    for item in items:
+        item.pop('score', None)
+    return items, cursor
+
+
+def list_items(session, item_type, brief=False, limit=None, cursor=None):
+    _, after = decode_cursor(cursor)
+    sql = LIST_ITEMS.format(columns=BRIEF_COLUMNS if brief else FULL_COLUMNS)
+    rows = session.connection().execute(text(sql), {'item_type': item_type, 'after': after, 'limit': limit or -1})
+    return page_rows(rows, limit)
+
+
+def search_items(session, item_type, query, brief=False, limit=50, cursor=None):
+    score, after = decode_cursor(cursor)
+    columns = BRIEF_COLUMNS if brief else FULL_COLUMNS
+    params = {'item_type': item_type, 'score': score, 'after': after, 'limit': limit}
+    match = fts_match(query)
+    if match:
+        sql = SEARCH_FTS.format(columns=columns + ', s.score')
+        params['match'] = match
+    else:
+        sql = SEARCH_LIKE.format(columns=columns)
+        params['like'] = like_pattern(query)
+    return page_rows(session.connection().execute(text(sql), params), limit)
+
+
+def like_pattern(query):
+    return '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def parse_manifest(functions):
+    # functions 由 mcpproxy 回写：{"tools": [{name, alias, description, inputSchema, server}], "servers": {...}, "discovered_at": ts}
+    try:
+        manifest = json.loads(functions or '{}')
+    except ValueError:
+        manifest = {}
+    if not isinstance(manifest, dict):
+        manifest = {}
+    manifest.setdefault('tools', [])
+    manifest.setdefault('discovered_at', None)
+    return manifest
+
+
+# 决定后端是哪个进程/地址的字段；cache、lazy 这些只给代理用的字段变了，落库的工具清单仍然有效
+LAUNCH_KEYS = ('type', 'command', 'args', 'env', 'url', 'baseUrl', 'headers')
+
+
+def prune_manifest(functions, old_servers, new_servers):
+    # 启动配置变了或被删掉的子服务，它们的工具清单作废，否则懒加载时会一直对外提供旧的工具，直到后端被唤醒
+    def launch(config):
+        return {k: v for k, v in (config or {}).items() if k in LAUNCH_KEYS} if isinstance(config, dict) else config
+    stale = {name for name, config in (old_servers or {}).items()
+             if name not in new_servers or launch(config) != launch(new_servers[name])}
+    if not stale or not functions: return functions
+    manifest = parse_manifest(functions)
+    manifest['tools'] = [tool for tool in manifest['tools'] if tool.get('server') not in stale]
+    manifest['servers'] = {name: info for name, info in (manifest.get('servers') or {}).items() if name not in stale}
+    return json.dumps(manifest, ensure_ascii=False) if manifest['tools'] else None
+
+
+def search_app_tools(session, query, limit=50, cursor=None):
+    score, after = decode_cursor(cursor)
+    params = {'score': score, 'after': after, 'limit': limit}
+    match = fts_match(query)
+    if match:
+        sql = SEARCH_APP_TOOLS
+        params['match'] = f'tools : ({match})'
+    else:
+        sql = SEARCH_APP_TOOLS_LIKE
+        params['like'] = like_pattern(query)
+    items, cursor = page_rows(session.connection().execute(text(sql), params), limit)
+    # 索引只定位到 app，具体是哪几个工具命中再从清单里挑出来
+    words = query.lower().split()
+    results = []
+    for item in items:
+        manifest = parse_manifest(item.pop('functions'))
+        tools = [{key: tool.get(key) for key in ('name', 'alias', 'description', 'server')}
+                 for tool in manifest['tools']
+                 if all(word in f"{tool.get('name', '')} {tool.get('description', '')}".lower() for word in words)]
+        if tools:
+            results.append(dict(item, tools=tools, discovered_at=manifest['discovered_at']))
+    return results, cursor
+
+
+def get_item(session, id, item_type):
+    item = session.get(appDB, id)
+    if not item or item.item_type != item_type:
+        return None
+    return item.model_dump()
+
+
+def delete_item(session, id, item_type):
+    item = session.get(appDB, id)
+    if not item or item.item_type != item_type:
+        return False
+    session.delete(item)
+    session.commit()
+    return True
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动时执行
-    create_db_and_tables()
+    await run_db(lambda session: create_db_and_tables())
     yield
     # 关闭时执行（如果有的话）
+    if service_client is not None:
+        await service_client.aclose()
+    await ServicePool.close()
+    db_executor.shutdown(wait=False)
 
 
 app = FastAPI(lifespan=lifespan)
@@ -54,64 +296,102 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # 允许所有HTTP方法
     allow_headers=["*"],  # 允许所有请求头
+    expose_headers=["X-Next-Cursor"],  # 分页游标放在响应头里，保持列表接口仍然返回数组
 )
 
+def paged(response, page):
+    items, cursor = page
+    if cursor:
+        response.headers['X-Next-Cursor'] = cursor
+    return items
+
+
 # 列出数据库里所有的保存的MCP服务的配置
 @app.get("/app/list")
-async def list_apps(session: Session = Depends(get_session)):
-    apps = session.exec(select(appDB).where(appDB.item_type == "app")).all()
-    return apps
+async def list_apps(response: Response, brief: bool = False, limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[str] = None):
+    return paged(response, await run_db(list_items, "app", brief, limit, cursor))
 
 
 # 搜索数据库里的所有的MCP服务名称
 @app.api_route("/app/search", methods=["GET"])
-async def search_apps(query: str = Query(...), session: Session = Depends(get_session)):
-    apps = session.exec(select(appDB).where(
-        (appDB.item_type == "app") & 
-        (appDB.name.contains(query) | appDB.description.contains(query))
-    )).all()
-    return apps
+async def search_apps(response: Response, query: str = Query(...), brief: bool = False,
+                      limit: int = Query(50, ge=1, le=1000), cursor: Optional[str] = None):
+    return paged(response, await run_db(search_items, "app", query, brief, limit, cursor))
+
+
+# 跨所有app搜索工具，回答“哪些app提供了类似X的工具”，只查库不启动任何进程
+@app.api_route("/app/tools/search", methods=["GET"])
+async def search_app_tools_api(response: Response, query: str = Query(...),
+                               limit: int = Query(50, ge=1, le=1000), cursor: Optional[str] = None):
+    return paged(response, await run_db(search_app_tools, query, limit, cursor))
+
+
+# 获取指定app最近一次发现的工具清单
+@app.api_route("/app/{id}/tools", methods=["GET"])
+async def get_app_tools(id: int):
+    app = await run_db(get_item, id, "app")
+    if not app:
+        raise HTTPException(status_code=404, detail="App not found")
+    return parse_manifest(app['functions'])
 
 
 # 获取指定名称的MCP服务的配置
 @app.api_route("/app/{id}", methods=["GET"])
-async def get_app(id: int, session: Session = Depends(get_session)):
-    app = session.get(appDB, id)
-    if not app or app.item_type != "app":
+async def get_app(id: int):
+    app = await run_db(get_item, id, "app")
+    if not app:
         raise HTTPException(status_code=404, detail="App not found")
     return app
 
 
 # 删除指定名称的MCP服务的配置
 @app.api_route("/app/{id}", methods=["DELETE"])
-async def delete_app(id: int, session: Session = Depends(get_session)):
-    app = session.get(appDB, id)
-    if not app or app.item_type != "app":
+async def delete_app(id: int):
+    if not await run_db(delete_item, id, "app"):
         raise HTTPException(status_code=404, detail="App not found")
-    session.delete(app)
-    session.commit()
     return {"status": "success", "message": f"App {id} deleted"}
 
 
 # 列出所有常用的MCP服务
 @app.api_route("/tool/list", methods=["GET"])
-async def list_tools(session: Session = Depends(get_session)):
-    tools = session.exec(select(appDB).where(appDB.item_type == "tool")).all()
-    return tools
+async def list_tools(response: Response, brief: bool = False, limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[str] = None):
+    return paged(response, await run_db(list_items, "tool", brief, limit, cursor))
 
 
 # 搜索常用的MCP服务
 @app.api_route("/tool/search", methods=["GET"])
-async def search_tools(query: str = Query(...), session: Session = Depends(get_session)):
-    tools = session.exec(select(appDB).where(
-        (appDB.item_type == "tool") & 
-        (appDB.name.contains(query) | appDB.description.contains(query))
-    )).all()
-    return tools
+async def search_tools(response: Response, query: str = Query(...), brief: bool = False,
+                       limit: int = Query(50, ge=1, le=1000), cursor: Optional[str] = None):
+    return paged(response, await run_db(search_items, "tool", query, brief, limit, cursor))
+
+
+def insert_tool(session, tool_name, description, config, hashcode):
+    # Check if tool with the same name already exists
+    existing_tool = session.exec(ITEM_BY_HASHCODE, params={'item_type': 'tool', 'hashcode': hashcode}).first()
+
+    if existing_tool:
+        raise HTTPException(status_code=409, detail=f"Tool with name '{tool_name}' already exists")
+
+    current_time = int(time.time())
+
+    new_tool = appDB(
+        name=tool_name,
+        description=description,
+        item_type="tool",
+        config=json.dumps(config),
+        hashcode=hashcode,
+        create_at=current_time,
+        modify_at=current_time
+    )
+
+    session.add(new_tool)
+    session.commit()
+    session.refresh(new_tool)
+    return new_tool.id
 
 
 @app.api_route("/tool/add", methods=["POST"])
-async def add_tool(request: Request, session: Session=Depends(get_session)):
+async def add_tool(request: Request):
     try:
         data = await request.json()
         tool_name = data.get('name')
@@ -122,34 +402,9 @@ async def add_tool(request: Request, session: Session=Depends(get_session)):
         if not tool_name or not config:
             raise HTTPException(status_code=400, detail="Tool name and config are required")
 
-        # Check if tool with the same name already exists
-        existing_tool = session.exec(
-            select(appDB).where(
-                (appDB.item_type == "tool") &
-                (appDB.hashcode == hashcode)
-            )
-        ).first()
-
-        if existing_tool:
-            raise HTTPException(status_code=409, detail=f"Tool with name '{tool_name}' already exists")
-
-        current_time = int(time.time())
-
-        new_tool = appDB(
-            name=tool_name,
-            description=description,
-            item_type="tool",
-            config=json.dumps(config),
-            hashcode=hashcode,
-            create_at=current_time,
-            modify_at=current_time
-        )
-
-        session.add(new_tool)
-        session.commit()
-        session.refresh(new_tool)
+        tool_id = await run_db(insert_tool, tool_name, description, config, hashcode)
 
-        return {"status": "success", "message": "Tool added", "id": new_tool.id}
+        return {"status": "success", "message": "Tool added", "id": tool_id}
 
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON format")
@@ -164,21 +419,18 @@ async def add_tool(request: Request, session: Session=Depends(get_session)):
 
 # 获取指定名称的常用MCP服务的配置
 @app.api_route("/tool/{id}", methods=["GET"])
-async def get_tool(id: int, session: Session = Depends(get_session)):
-    tool = session.get(appDB, id)
-    if not tool or tool.item_type != "tool":
+async def get_tool(id: int):
+    tool = await run_db(get_item, id, "tool")
+    if not tool:
         raise HTTPException(status_code=404, detail="Tool not found")
     return tool
 
 
 # 删除指定名称的常用MCP服务的配置
 @app.api_route("/tool/{id}", methods=["DELETE"])
-async def delete_tool(id: int, session: Session = Depends(get_session)):
-    tool = session.get(appDB, id)
-    if not tool or tool.item_type != "tool":
+async def delete_tool(id: int):
+    if not await run_db(delete_item, id, "tool"):
         raise HTTPException(status_code=404, detail="Tool not found")
-    session.delete(tool)
-    session.commit()
     return {"status": "success", "message": f"Tool {id} deleted"}
 
 
@@ -205,8 +457,59 @@ async def test_tool(request: Request):
 
 
 # 对用户的提交进行解析，并将mcp.json进行解析，该落库的落库
+def save_app(session, data, app_name, description, app_id):
+    current_time = int(time.time())
+    servers = data.get('mcpServers')
+    hashcode = hashlib.md5(json.dumps(servers).encode()).hexdigest()
+    
+    
+    # 存储应用到数据库
+    existing_app = session.exec(ITEM_BY_HASHCODE, params={'item_type': 'app', 'hashcode': hashcode}).first()
+    
+    if existing_app:
+       raise Exception('duplicated app config')
+    
+
+    if app_id:
+        app_to_update = session.get(appDB, app_id)
+        if not app_to_update or app_to_update.item_type != "app":
+            raise HTTPException(status_code=404, detail=f"App with id {app_id} not found")
+
+        try:
+            old_servers = json.loads(app_to_update.config or '{}').get('mcpServers') or {}
+        except (ValueError, AttributeError):
+            old_servers = {}
+        app_to_update.functions = prune_manifest(app_to_update.functions, old_servers, servers)
+
+        app_to_update.name = app_name
+        app_to_update.description = description
+        app_to_update.config = json.dumps(data)
+        app_to_update.hashcode = hashcode
+        app_to_update.modify_at = current_time
+
+        session.add(app_to_update)
+        session.commit()
+        session.refresh(app_to_update)
+        return {"status": "success", "message": f"App {app_id} updated", "id": app_to_update.id}
+
+    
+    new_app = appDB(
+        name=app_name,
+        description=description,
+        item_type="app",  # 修改 type 为 item_type
+        config=json.dumps(data),
+        hashcode=hashcode,
+        create_at=current_time,
+        modify_at=current_time
+    )
+    session.add(new_app)
+    session.commit()
+    session.refresh(new_app)
+    return {"status": "success", "message": "App created", "id": new_app.id}
+
+
 @app.api_route("/app/submit", methods=["POST"])
-async def submit_work(request: Request, session: Session = Depends(get_session)):
+async def submit_work(request: Request):
     try:
         data = await request.json()
         app_name = data.get('name') or data.get('appName')
@@ -220,67 +523,7 @@ async def submit_work(request: Request, session: Session = Depends(get_session))
         if not data.get('mcpServers', {}):
             return Response(status_code=400, content="Invalid data format")
             
-        current_time = int(time.time())
-        servers = data.get('mcpServers')
-        hashcode = hashlib.md5(json.dumps(servers).encode()).hexdigest()
-        
-        
-        # 存储应用到数据库
-        existing_app = session.exec(
-            select(appDB).where(
-                (appDB.item_type == "app") & 
-                (appDB.hashcode == hashcode)
-            )
-        ).first()
-        
-        if existing_app:
-           raise Exception('duplicated app config')
-        
-        
-        # If app_id is not provided, proceed with creating a new app (existing logic follows)
-        # Check for duplicates before creating a new one
-        existing_app = session.exec(
-            select(appDB).where(
-                (appDB.item_type == "app") &
-                (appDB.hashcode == hashcode)
-            )
-        ).first()
-
-        if existing_app:
-           raise HTTPException(status_code=409, detail='App config conflicts with an existing app')
-        
-
-
-        if app_id:
-            app_to_update = session.get(appDB, app_id)
-            if not app_to_update or app_to_update.item_type != "app":
-                raise HTTPException(status_code=404, detail=f"App with id {app_id} not found")
-
-            app_to_update.name = app_name
-            app_to_update.description = description
-            app_to_update.config = json.dumps(data)
-            app_to_update.hashcode = hashcode
-            app_to_update.modify_at = current_time
-
-            session.add(app_to_update)
-            session.commit()
-            session.refresh(app_to_update)
-            return {"status": "success", "message": f"App {app_id} updated", "id": app_to_update.id}
-
-        
-        new_app = appDB(
-            name=app_name,
-            description=description,
-            item_type="app",  # 修改 type 为 item_type
-            config=json.dumps(data),
-            hashcode=hashcode,
-            create_at=current_time,
-            modify_at=current_time
-        )
-        session.add(new_app)
-        session.commit()
-        session.refresh(new_app)
-        return {"status": "success", "message": "App created", "id": new_app.id}
+        return await run_db(save_app, data, app_name, description, app_id)
     
     except Exception as e:
         return Response(status_code=500, content=f"Error submitting work: {str(e)}")
@@ -289,27 +532,43 @@ async def submit_work(request: Request, session: Session = Depends(get_session))
 
 
 class ServiceStatus:
-
-    process = {}
-
-    async def start_service(self, id):
-        if id in self.process:
-            return False
-        proc = await asyncio.create_subprocess_shell(f'uv run bin/mcpproxy.py -c {id}')
-        self.process[id] = proc
-        await proc.wait()
-        self.process.pop(id, None)
-
-
-    def stop_service(self, id):
-        if id not in self.process: return False
-        proc = self.process[id]
-        proc.terminate()
-        return True
-
-
-    def get_services(self):
-        return list(self.process.keys())
+    # 代理进程由 bin/mcpsupervisor.py 常驻管理并落盘，这里只是它控制通道的客户端，控制面本身不持有进程状态
+
+    client = None
+
+    def get_client(self):
+        if self.client is None:
+            transport = httpx.AsyncHTTPTransport(uds=SUPERVISOR_SOCK)
+            ServiceStatus.client = httpx.AsyncClient(transport=transport, base_url='http://supervisor', timeout=15)
+        return self.client
+
+    async def call(self, method, path):
+        try:
+            return await self.get_client().request(method, path)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=503, detail=f"Supervisor unavailable: {str(e)}")
+
+    async def start_service(self, id, replicas=1):
+        r = await self.call('POST', f'/services/{id}?replicas={replicas}')
+        if r.status_code != 200:
+            raise HTTPException(status_code=r.status_code, detail=r.json().get('message'))
+        return r.json()['service']
+
+    async def stop_service(self, id):
+        r = await self.call('DELETE', f'/services/{id}')
+        return r.status_code == 200
+
+    async def get_records(self):
+        r = await self.call('GET', '/services')
+        return r.json()['services']
+
+    async def get_services(self):
+        return list(await self.get_records())
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            ServiceStatus.client = None
         
 
 ServicePool = ServiceStatus()
@@ -323,24 +582,195 @@ async def start_service(request: Request):
     if not (isinstance(id, str) and id.isdigit() and id.isnumeric()):
         return Response(status_code=400, content="Invalid ID format")
 
-    asyncio.create_task(ServicePool.start_service(id))
-    await asyncio.sleep(0.5)
-    return ServicePool.get_services()
+    # replicas > 1 时同一个 app 起多个副本进程，由路由层按 session_id 做会话亲和
+    replicas = data.get('replicas', 1)
+    if not (isinstance(replicas, int) and 1 <= replicas <= (os.cpu_count() or 1) * 4):
+        return Response(status_code=400, content="Invalid replicas")
+    await ServicePool.start_service(id, replicas)
+    ServiceBoard.updated = 0
+    return await ServicePool.get_services()
+
+def get_service_client():
+    global service_client
+    if service_client is None:
+        service_client = httpx.AsyncClient(base_url=SERVICE_BASE, timeout=5,
+                                           limits=httpx.Limits(max_connections=64, max_keepalive_connections=32))
+    return service_client
+
+
+def worker_replicas(record):
+    # 多副本 app 的各副本号；单副本的返回空列表，直接访问 /mcp/{id}/...
+    return [w['replica'] for w in record.get('workers', []) if w.get('replica') is not None]
+
+
+def replica_params(replica):
+    return None if replica is None else {'replica': replica}
+
+
+# 这些字段是配置，合并多副本状态时取第一个副本的值，其余的数值加总
+SHARED_STATUS_FIELDS = ('heartbeat', 'idle_timeout')
+
+
+def merge_status(parts):
+    # 多副本的状态以第一个能访问的副本为准，会话、在途请求和缓存计数加总，各副本的完整状态放在 replicas 里
+    ok = [status for status in parts.values() if status.get('status') != 'unreachable']
+    if not ok: return next(iter(parts.values()))
+    merged = dict(ok[0], replicas={str(replica): status for replica, status in parts.items()})
+    merged['connection_cnt'] = sum(status.get('connection_cnt') or 0 for status in ok)
+    for key in ('sessions', 'inflight', 'cache'):
+        if not isinstance(ok[0].get(key), dict): continue
+        merged[key] = {field: value if field in SHARED_STATUS_FIELDS or not isinstance(value, (int, float))
+                       else sum((status.get(key) or {}).get(field) or 0 for status in ok)
+                       for field, value in ok[0][key].items()}
+    return merged
+
+
+def diff_status(old, new):
+    changed = {id: status for id, status in new.items() if old.get(id) != status}
+    changed.update({id: None for id in old if id not in new})
+    return changed
+
+
+class StatusBoard:
+    # 所有运行中服务的状态一次并发抓完，TTL 内直接复用；有订阅者时后台定时刷新，变化推送给订阅者
+
+    def __init__(self, ttl=STATUS_TTL):
+        self.ttl = ttl
+        self.services = {}
+        self.updated = 0
+        self.sweeping = None
+        self.watcher = None
+        self.subscribers = set()
+
+    async def fetch_one(self, id, replica=None):
+        try:
+            r = await get_service_client().get(f'/mcp/{id}/server_status', params=replica_params(replica))
+            r.raise_for_status()
+            return r.json()
+        except Exception as e:
+            return {'status': 'unreachable', 'message': str(e)}
+
+    async def fetch(self, id, replicas=()):
+        # /mcp/{id}/... 只会路由到0号副本，多副本时逐个副本抓取再合并
+        if not replicas: return await self.fetch_one(id)
+        parts = await asyncio.gather(*[self.fetch_one(id, replica) for replica in replicas])
+        return merge_status(dict(zip(replicas, parts)))
+
+    async def sweep(self):
+        records = await ServicePool.get_records()
+        ids = list(records)
+        services = dict(zip(ids, await asyncio.gather(*[self.fetch(id, worker_replicas(records[id])) for id in ids])))
+        changed = diff_status(self.services, services)
+        self.services = services
+        self.updated = time.monotonic()
+        if changed:
+            for waiter in self.subscribers:
+                waiter.set()
+        return services
+
+    async def collect(self):
+        if time.monotonic() - self.updated < self.ttl:
+            return self.services
+        # 同一时刻只有一轮抓取，并发的请求等同一个结果
+        if not self.sweeping or self.sweeping.done():
+            self.sweeping = asyncio.ensure_future(self.sweep())
+        return await asyncio.shield(self.sweeping)
+
+    async def run_watcher(self):
+        while self.subscribers:
+            try:
+                await self.collect()
+            except HTTPException:
+                pass
+            await asyncio.sleep(self.ttl)
+
+    async def watch(self):
+        # 先推一份完整快照，之后只推有变化的服务，已停止的服务值为 null
+        event = asyncio.Event()
+        self.subscribers.add(event)
+        if not self.watcher or self.watcher.done():
+            self.watcher = asyncio.ensure_future(self.run_watcher())
+        try:
+            services = await self.collect()
+            yield f'event: status\ndata: {json.dumps(services)}\n\n'
+            while True:
+                try:
+                    await asyncio.wait_for(event.wait(), 15)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                event.clear()
+                changed = diff_status(services, self.services)
+                services = self.services
+                if changed:
+                    yield f'event: status\ndata: {json.dumps(changed)}\n\n'
+        finally:
+            self.subscribers.discard(event)
+
+
+ServiceBoard = StatusBoard()
+
 
 @app.api_route("/service/status", methods=["GET"])
-async def status_service():
-    # 获取服务状态的逻辑
-    services = ServicePool.get_services()
-    return {"status": "success", "services": services}
+async def status_service(detail: bool = False):
+    # 获取服务状态的逻辑，detail=1 时一次带回所有运行中服务的状态
+    services = await ServicePool.get_services()
+    if not detail:
+        return {"status": "success", "services": services}
+    return {"status": "success", "services": services, "details": await ServiceBoard.collect()}
+
+
+# 服务状态变化的推送流（SSE），替代前端逐个轮询
+@app.api_route("/service/events", methods=["GET"])
+async def status_events():
+    return StreamingResponse(ServiceBoard.watch(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 
 @app.api_route("/service/status/{id}", methods=["GET"])
 async def status_service_id(id: str):
-    try:
-        id = int(id)
-        r = await httpx.AsyncClient().get(f'http://127.0.0.1/mcp/{id}/server_status')
-        return r.json()
-    except Exception as e:
-        return Response(status_code=500, content=f"Error getting service status: {str(e)}")
+    if not id.isdigit():
+        return Response(status_code=400, content="Invalid ID format")
+    status = (await ServiceBoard.collect()).get(id) or await ServiceBoard.fetch(id)
+    if status.get('status') == 'unreachable':
+        return Response(status_code=500, content=f"Error getting service status: {status['message']}")
+    return status
+
+
+def merge_metrics(texts):
+    # 多个服务的 Prometheus 文本合并：同名指标的 HELP/TYPE 只保留一份，样本按指标归到一起
+    families = {}
+    for body in texts:
+        family = None
+        for line in body.splitlines():
+            if not line.strip(): continue
+            if line.startswith('# '):
+                parts = line.split(' ', 3)
+                if len(parts) < 3: continue
+                family = families.setdefault(parts[2], {'meta': [], 'samples': []})
+                if line not in family['meta']: family['meta'].append(line)
+            elif family is not None:
+                family['samples'].append(line)
+    lines = []
+    for family in families.values():
+        lines.extend(family['meta'])
+        lines.extend(family['samples'])
+    return '\n'.join(lines) + '\n'
+
+
+@app.api_route("/service/metrics", methods=["GET"])
+async def metrics_service():
+    # 并发抓取所有运行中服务的 /metrics 并合并成一份；多副本的 app 每个副本抓一次，样本带 replica 标签
+    records = await ServicePool.get_records()
+    targets = [(id, replica) for id, record in records.items() for replica in worker_replicas(record) or [None]]
+    client = get_service_client()
+    results = await asyncio.gather(*[client.get(f'/mcp/{id}/metrics', params=replica_params(replica)) for id, replica in targets],
+                                   return_exceptions=True)
+    texts = [r.text for r in results if isinstance(r, httpx.Response) and r.status_code == 200]
+    up = ''.join(f'mcpez_service_up{{app="{id}"' + ('' if replica is None else f',replica="{replica}"') + '} '
+                 f'{int(isinstance(r, httpx.Response) and r.status_code == 200)}\n' for (id, replica), r in zip(targets, results))
+    texts.append('# HELP mcpez_service_up whether the service answered the metrics scrape\n# TYPE mcpez_service_up gauge\n' + up)
+    return Response(content=merge_metrics(texts), media_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.api_route("/service/stop", methods=["POST"])
@@ -351,8 +781,9 @@ async def stop_service(request: Request):
     if not (isinstance(id, str) and id.isdigit() and id.isnumeric()):
         return Response(status_code=400, content="Invalid ID format")
 
-    ServicePool.stop_service(id)
-    await asyncio.sleep(0.5)
+    if not await ServicePool.stop_service(id):
+        return Response(status_code=404, content=f"Service {id} is not running")
+    ServiceBoard.updated = 0
     return {"status": "success", "message": f"Service {id} stopped"}
 
 
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from libs.mcpez import MCPEazy
+
+
+class GatedBackend:
+    # 每次 tools/call 都卡在 gate 上，直到测试放行
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+        self.gate = asyncio.Event()
+
+    async def request(self, method, params, owner=None, relay=None):
+        self.calls += 1
+        n = self.calls
+        try:
+            await self.gate.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return {'result': {'content': [{'type': 'text', 'text': str(n)}]}}
+
+
+class RecordingSession:
+    def __init__(self):
+        self.frames = []
+
+    async def write_jsonrpc(self, req_id, result):
+        self.frames.append({'id': req_id, **result})
+
+
+def make_eazy(backend):
+    eazy = MCPEazy('test')
+    eazy.functions['echo'] = {'name': 'echo', 'srv': backend, 'srvname': 'gated', 'ttl': 0, 'coalesce': True}
+    eazy.last_used['gated'] = 0
+    return eazy
+
+
+def call(eazy, req_id, session):
+    return asyncio.ensure_future(eazy.call_tools({'id': req_id, 'params': {'name': 'echo', 'arguments': {'q': 1}}}, session))
+
+
+def test_identical_calls_share_one_backend_request():
+    async def run():
+        backend = GatedBackend()
+        eazy = make_eazy(backend)
+        session = RecordingSession()
+        tasks = [call(eazy, i, session) for i in range(3)]
+        await asyncio.sleep(0.01)
+        backend.gate.set()
+        await asyncio.gather(*tasks)
+        return backend, eazy, session
+
+    backend, eazy, session = asyncio.run(run())
+    assert backend.calls == 1
+    assert eazy.coalesced == 2
+    assert eazy.inflight == {}
+    assert sorted(frame['id'] for frame in session.frames) == [0, 1, 2]
+    assert all(frame['result']['content'][0]['text'] == '1' for frame in session.frames)
+
+
+def test_backend_call_is_cancelled_only_by_the_last_waiter():
+    async def run():
+        backend = GatedBackend()
+        eazy = make_eazy(backend)
+        session = RecordingSession()
+        first, second = call(eazy, 1, session), call(eazy, 2, session)
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        cancelled_after_first = backend.cancelled
+        second.cancel()
+        await asyncio.sleep(0.01)
+        return backend, eazy, cancelled_after_first
+
+    backend, eazy, cancelled_after_first = asyncio.run(run())
+    assert cancelled_after_first == 0
+    assert backend.cancelled == 1
+    assert eazy.inflight == {}
+
+
+def test_call_arriving_while_last_waiter_cancels_starts_a_new_flight():
+    async def run():
+        backend = GatedBackend()
+        eazy = make_eazy(backend)
+        session = RecordingSession()
+        first = call(eazy, 1, session)
+        await asyncio.sleep(0.01)
+        first.cancel()
+        while not first.done():
+            await asyncio.sleep(0)
+        # 最后一个等待者刚走，被取消的后端调用还没走完，完成回调也还没跑
+        second = call(eazy, 2, session)
+        await asyncio.sleep(0.01)
+        backend.gate.set()
+        await second
+        return backend, eazy, session
+
+    backend, eazy, session = asyncio.run(run())
+    assert backend.calls == 2
+    assert eazy.inflight == {}
+    assert len(session.frames) == 1
+    assert session.frames[0]['id'] == 2
+    assert session.frames[0]['result']['content'][0]['text'] == '2'
+
+
+class ListBackend:
+    async def request(self, method, params, owner=None, relay=None):
+        return {'result': ['a', 'b']}
+
+
+def test_non_object_result_is_answered_once():
+    async def run():
+        eazy = make_eazy(ListBackend())
+        session = RecordingSession()
+        await call(eazy, 20, session)
+        return session
+
+    session = asyncio.run(run())
+    assert session.frames == [{'id': 20, 'result': ['a', 'b']}]
+
+
+def test_non_object_result_is_cached():
+    async def run():
+        backend = ListBackend()
+        eazy = make_eazy(backend)
+        eazy.functions['echo']['ttl'] = 60
+        session = RecordingSession()
+        await call(eazy, 21, session)
+        backend.request = None
+        await call(eazy, 22, session)
+        return session
+
+    session = asyncio.run(run())
+    assert session.frames == [{'id': 21, 'result': ['a', 'b']}, {'id': 22, 'result': ['a', 'b']}]
+
+
+def test_cache_rule_may_be_a_bare_ttl():
+    assert MCPEazy.parse_cache_rules('b', 60) == {'*': 60}
+    assert MCPEazy.parse_cache_rules('b', {'echo': 30, 'bad': 'x'}) == {'echo': 30}
+    assert MCPEazy.parse_cache_rules('b', 'forever') == {}
+    assert MCPEazy.parse_cache_rules('b', None) == {}
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from libs.mcpez import MCPEazy
+
+
+# stdio 后端：tools/list 返回 tools 个带长描述的工具，tools/call 返回 size 个字符的文本，order 为 last 时 jsonrpc 写在 result 后面
+STDIO_BACKEND = '''
+import json, sys
+tools, order = int(sys.argv[1]), sys.argv[2]
+for line in sys.stdin:
+    req = json.loads(line)
+    if 'id' not in req:
+        continue
+    if req['method'] == 'tools/list':
+        result = {'tools': [{'name': f'tool{i}', 'description': 'd' * 1000, 'inputSchema': {'type': 'object'}} for i in range(tools)]}
+    else:
+        args = req['params']['arguments']
+        result = {'content': [{'type': 'text', 'text': 'x' * args['size']}], 'isError': args.get('isError', False)}
+    reply = {'jsonrpc': '2.0', 'id': req['id'], 'result': result}
+    if order == 'last':
+        reply = {'id': req['id'], 'result': result, 'jsonrpc': '2.0'}
+    print(json.dumps(reply, separators=(',', ':')), flush=True)
+'''
+
+
+def stdio_config(tmp_path, tools=1, order='first'):
+    script = tmp_path / 'backend.py'
+    script.write_text(STDIO_BACKEND)
+    return {'command': sys.executable, 'args': [str(script), str(tools), order]}
+
+
+class PrettyBackend(tornado.web.RequestHandler):
+    # Streamable HTTP 后端，application/json 响应是带缩进的多行 JSON
+    def post(self):
+        req = json.loads(self.request.body)
+        if 'id' not in req:
+            self.set_status(202)
+            return
+        if req['method'] == 'tools/list':
+            result = {'tools': [{'name': 'blob', 'description': 'blob', 'inputSchema': {'type': 'object'}}]}
+        elif req['method'] == 'tools/call':
+            result = {'content': [{'type': 'text', 'text': 'x' * req['params']['arguments']['size']}]}
+        else:
+            result = {}
+        self.set_header('Content-Type', 'application/json')
+        self.set_header('Mcp-Session-Id', 'pretty')
+        self.finish(json.dumps({'jsonrpc': '2.0', 'id': req['id'], 'result': result}, indent=2))
+
+    def delete(self):
+        pass
+
+
+class RecordingSession:
+    def __init__(self):
+        self.frames = []
+
+    async def write_jsonrpc(self, req_id, result):
+        self.frames.append(json.dumps({'jsonrpc': '2.0', 'id': req_id, 'result': result}))
+
+    async def write_jsonrpc_chunks(self, req_id, chunks):
+        self.frames.append('{"jsonrpc": "2.0", "id": ' + json.dumps(req_id) + ', "result": '
+                           + b''.join(chunks).decode() + '}')
+
+
+def test_large_multiline_http_result_is_reserialized():
+    async def run():
+        sockets = bind_sockets(0, '127.0.0.1')
+        server = HTTPServer(tornado.web.Application([(r'/mcp', PrettyBackend)]))
+        server.add_sockets(sockets)
+        url = f"http://127.0.0.1:{sockets[0].getsockname()[1]}/mcp"
+        eazy = MCPEazy('test')
+        try:
+            await eazy.add_mcp_server('pretty', {'type': 'streamable-http', 'url': url, 'rawThreshold': 1024})
+            session = RecordingSession()
+            name = eazy.tools[0]['name']
+            await eazy.call_tools({'id': 7, 'params': {'name': name, 'arguments': {'size': 200000}}}, session)
+            return session.frames
+        finally:
+            await eazy.stop()
+            server.stop()
+
+    frames = asyncio.run(run())
+    assert len(frames) == 1
+    # 写进一行 SSE data 的内容不能带换行，否则客户端的 SSE 解析会断开
+    assert '\n' not in frames[0] and '\r' not in frames[0]
+    message = json.loads(frames[0])
+    assert message['id'] == 7
+    assert len(message['result']['result']['content'][0]['text']) == 200000
+
+
+def test_large_tools_list_registers_every_tool(tmp_path):
+    async def run():
+        eazy = MCPEazy('test')
+        try:
+            await eazy.add_mcp_server('many', stdio_config(tmp_path, tools=150))
+            return len(eazy.tools)
+        finally:
+            await eazy.stop()
+            await asyncio.sleep(0.2)
+
+    assert asyncio.run(run()) == 150
+
+
+@pytest.mark.parametrize('order', ['first', 'last'])
+@pytest.mark.parametrize('ttl', [0, 60])
+def test_large_result_is_relayed_whatever_the_key_order(tmp_path, order, ttl):
+    async def run():
+        eazy = MCPEazy('test')
+        try:
+            await eazy.add_mcp_server('blob', dict(stdio_config(tmp_path, order=order), cache={'*': ttl}))
+            session = RecordingSession()
+            await eazy.call_tools({'id': 8, 'params': {'name': eazy.tools[0]['name'], 'arguments': {'size': 200000}}}, session)
+            return session.frames
+        finally:
+            await eazy.stop()
+            await asyncio.sleep(0.2)
+
+    frames = asyncio.run(run())
+    assert len(frames) == 1
+    message = json.loads(frames[0])
+    assert message['id'] == 8
+    assert message['result'] == {'result': {'content': [{'type': 'text', 'text': 'x' * 200000}], 'isError': False}}
+
+
+@pytest.mark.parametrize('ttl', [0, 60])
+def test_large_tool_error_is_counted_and_not_cached(tmp_path, ttl):
+    async def run():
+        eazy = MCPEazy('test')
+        try:
+            await eazy.add_mcp_server('blob', dict(stdio_config(tmp_path), cache={'*': ttl}))
+            session = RecordingSession()
+            await eazy.call_tools({'id': 9, 'params': {'name': eazy.tools[0]['name'], 'arguments': {'size': 200000, 'isError': True}}}, session)
+            return eazy, session.frames
+        finally:
+            await eazy.stop()
+            await asyncio.sleep(0.2)
+
+    eazy, frames = asyncio.run(run())
+    assert json.loads(frames[0])['result']['result']['isError'] is True
+    assert eazy.metrics.errors[('blob', 'tool0')] == 1
+    assert eazy.cache.status()['entries'] == 0
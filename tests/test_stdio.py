@@ -0,0 +1,90 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from libs.mcpcli import MCPCli
+
+
+# 最简单的 stdio 后端：tools/call 返回 size 个字符的文本
+BACKEND = '''
+import json, sys
+for line in sys.stdin:
+    req = json.loads(line)
+    if 'id' not in req:
+        continue
+    if req['method'] == 'tools/call' and req['params']['arguments'].get('exit'):
+        sys.exit(1)
+    if req['method'] == 'tools/list':
+        result = {'tools': [{'name': 'blob', 'inputSchema': {'type': 'object'}}]}
+    else:
+        result = {'content': [{'type': 'text', 'text': 'x' * req['params']['arguments']['size']}]}
+    print(json.dumps({'jsonrpc': '2.0', 'id': req['id'], 'result': result}), flush=True)
+'''
+
+
+def stdio_config(tmp_path, source, **extra):
+    script = tmp_path / 'backend.py'
+    script.write_text(source)
+    return dict({'command': sys.executable, 'args': [str(script)]}, **extra)
+
+
+def test_oversized_frame_fails_its_call_at_once(tmp_path):
+    async def run():
+        cli = MCPCli(stdio_config(tmp_path, BACKEND, maxFrameBytes=4096), name='blob')
+        await cli.init()
+        try:
+            begin = time.monotonic()
+            with pytest.raises(ValueError, match='maxFrameBytes'):
+                await cli.request('tools/call', {'name': 'blob', 'arguments': {'size': 100000}})
+            elapsed = time.monotonic() - begin
+            # 后面的帧照常读
+            r = await cli.request('tools/call', {'name': 'blob', 'arguments': {'size': 10}})
+            return elapsed, r, cli.status()
+        finally:
+            cli.close()
+            # 等子进程退出、管道关掉，免得事件循环关闭后才回收
+            await asyncio.sleep(0.2)
+
+    elapsed, r, status = asyncio.run(run())
+    assert elapsed < 5
+    assert r['result']['content'][0]['text'] == 'x' * 10
+    assert status['inflight'] == 0 and status['pending'] == 0
+
+
+def test_process_exiting_during_handshake_fails_at_once(tmp_path):
+    async def run():
+        cli = MCPCli(stdio_config(tmp_path, 'import sys\nsys.stderr.write("bad config\\n")\nsys.exit(3)\n'), name='crash')
+        begin = time.monotonic()
+        with pytest.raises(ConnectionError) as e:
+            await cli.init()
+        elapsed = time.monotonic() - begin
+        await asyncio.sleep(0.2)
+        return elapsed, str(e.value)
+
+    elapsed, error = asyncio.run(run())
+    assert elapsed < 5
+    assert 'exited with 3' in error and 'bad config' in error
+
+
+def test_crashed_backend_promotes_a_ready_spare_without_backoff(tmp_path):
+    async def run():
+        cli = MCPCli(stdio_config(tmp_path, BACKEND, spares=1), name='spare')
+        await cli.init()
+        try:
+            while not cli.spares:
+                await asyncio.sleep(0.05)
+            spare = cli.spares[0]
+            with pytest.raises(ConnectionError):
+                await cli.request('tools/call', {'name': 'blob', 'arguments': {'exit': True}})
+            await asyncio.sleep(0.3)
+            return cli.restarts, cli.process is spare
+        finally:
+            cli.close()
+            await asyncio.sleep(0.2)
+
+    assert asyncio.run(run()) == (1, True)
@@ -14,7 +14,9 @@ class ServiceController {
         // 当前选中的应用ID
         this.selectedAppId = null;
         this.runningServices = [];
+        this.serviceDetails = {};
         this.allApps = [];
+        this.statusStream = null;
         
         // 全局暴露实例，使HTML中的事件能够访问
         window.serviceCtl = this;
@@ -32,6 +34,9 @@ class ServiceController {
         
         // 设置事件监听器
         this.setupEventListeners();
+        
+        // 订阅服务状态推送
+        this.watchServiceStatus();
     }
     
     /**
@@ -48,6 +53,7 @@ class ServiceController {
         this.stopService = this.stopService.bind(this);
         this.showServiceDetails = this.showServiceDetails.bind(this);
         this.showAppDetails = this.showAppDetails.bind(this);
+        this.onServiceStatus = this.onServiceStatus.bind(this);
     }
     
     /**
@@ -85,7 +91,7 @@ class ServiceController {
         
         // 同时请求应用列表和服务状态
         Promise.all([
-            fetch(`${this.API_BASE}/app/list`).then(resp => resp.json()),
+            fetch(`${this.API_BASE}/app/list?brief=1`).then(resp => resp.json()),
             fetch(`${this.API_BASE}/service/status`).then(resp => resp.json())
         ])
         .then(([apps, serviceData]) => {
@@ -106,6 +112,44 @@ class ServiceController {
         });
     }
     
+    /**
+     * 订阅服务状态推送流，代替逐个服务轮询
+     * 首条消息是所有运行中服务的完整状态，之后只推送有变化的服务，值为 null 表示服务已停止
+     */
+    watchServiceStatus() {
+        if (!window.EventSource) return;
+        this.statusStream = new EventSource(`${this.API_BASE}/service/events`);
+        this.statusStream.addEventListener('status', this.onServiceStatus);
+    }
+    
+    /**
+     * 处理服务状态推送
+     * @param {MessageEvent} event 推送事件
+     */
+    onServiceStatus(event) {
+        const changed = JSON.parse(event.data);
+        Object.entries(changed).forEach(([id, status]) => {
+            if (status === null) {
+                delete this.serviceDetails[id];
+            } else {
+                this.serviceDetails[id] = status;
+            }
+        });
+        
+        const running = Object.keys(this.serviceDetails);
+        if (running.sort().join(',') !== [...this.runningServices].sort().join(',')) {
+            this.runningServices = running;
+            this.updateAppServiceTable();
+            this.filterApps();
+        }
+        
+        // 详情模态框打开着的话同步刷新
+        const serviceId = document.getElementById('serviceModalId').textContent;
+        if (changed[serviceId] && !document.getElementById('serviceStatusContent').classList.contains('hidden')) {
+            document.getElementById('serviceModalDetails').textContent = JSON.stringify(changed[serviceId], null, 2);
+        }
+    }
+    
     /**
      * 更新应用服务表格
      */
@@ -291,6 +335,14 @@ class ServiceController {
         const statusEl = document.getElementById('serviceModalStatus');
         statusEl.innerHTML = `<span class="inline-flex items-center px-2.5 py-0.5 rounded-full text-xs font-medium bg-green-100 text-green-800">运行中</span>`;
         
+        // 推送流里已有的状态直接展示
+        if (this.serviceDetails[serviceId]) {
+            document.getElementById('serviceStatusLoading').classList.add('hidden');
+            document.getElementById('serviceStatusContent').classList.remove('hidden');
+            document.getElementById('serviceModalDetails').textContent = JSON.stringify(this.serviceDetails[serviceId], null, 2);
+            return;
+        }
+        
         // 加载服务详情
         fetch(`${this.API_BASE}/service/status/${serviceId}`)
             .then(response => {